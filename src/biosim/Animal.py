@@ -6,14 +6,48 @@ The Animal class with Herbivores and Carnivores as subclasses of Animal.
 __author__ = 'Hongpeng Zhang and Sujan Devkota'
 __email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
 
+import math
 import numpy as np
-import random
-import numba
+from operator import attrgetter
+from biosim import _kernels
+
+# hunted lists longer than this are summed up with numpy, shorter ones in plain Python where the
+# numpy call overhead would dominate
+_NUMPY_EAT_MIN_LENGTH = 64
+
+# read the stored age, weight and migration season straight from the slots, so the numpy arrays
+# of many animals are gathered without a Python call per animal
+age_getter = attrgetter('_age')
+weight_getter = attrgetter('_weight')
+moved_year_getter = attrgetter('moved_year')
+
+
+def fitness_param_vec(parameter):
+    """
+    Get the fitness parameters in the order the compiled kernels unpack them, read only so a
+    stale copy can not be changed in place.
+
+    Parameters
+    ----------
+    parameter: dictionary
+
+    Returns
+    -------
+    Numpy array
+        phi_age, a_half, phi_weight and w_half
+    """
+    param_vec = np.array([parameter[key] for key in ('phi_age', 'a_half', 'phi_weight', 'w_half')],
+                         dtype=np.float64)
+    param_vec.flags.writeable = False
+    return param_vec
 
 
 class Animal:
     """The animal class with Herbivores and carnivores."""
+    __slots__ = ('_age', '_weight', 'moved_year', '_fitness', '_fitness_version')
     parameter = {}
+    # increased each time animal parameters are changed, so cached fitness values get outdated
+    _parameter_version = 0
 
     def __init__(self, age=0, weight=None):
         """
@@ -23,37 +57,37 @@ class Animal:
         age: int
         weight: float or int
         """
+        self._fitness = None
+        self._fitness_version = Animal._parameter_version
         self.age = age
         self.weight = weight
-        self.moved = False
+        self.moved_year = -1  # the last migration season the animal moved in
 
-    @staticmethod
-    @numba.jit
-    def fitness_formula(plus_minus, x, x_half, phi_x):
-        """
-        Method to return the formula to be used in fitness calculation
+    @property
+    def age(self):
+        """Age of the animal. Setting the age clears the cached fitness."""
+        return self._age
 
-        Parameters
-        ----------
-        plus_minus: 1 or -1
-        x: int or float
-            age or weight
-        x_half: int or float
-            a_half or w_half
-        phi_x: int or float
-            phi_age or phi_weight
+    @age.setter
+    def age(self, value):
+        self._age = value
+        self._fitness = None
 
-        Returns
-        -------
-        Formula to be used in fitness calculation
-        """
-        formula = 1 / (1 + np.power(np.e, plus_minus * phi_x * (x - x_half)))
-        return formula
+    @property
+    def weight(self):
+        """Weight of the animal. Setting the weight clears the cached fitness."""
+        return self._weight
+
+    @weight.setter
+    def weight(self, value):
+        self._weight = value
+        self._fitness = None
 
     @classmethod
     def fitness_calculation(cls, age, weight, parameter):
         """
-        Method to calculate the fitness of the animals
+        Method to calculate the fitness of the animals with the compiled fitness kernel, 0 if the
+            weight is <= 0.
 
         Parameters
         ----------
@@ -65,24 +99,42 @@ class Animal:
         -------
         The fitness of the specific animal.
         """
-        fitness = cls.fitness_formula(1, age, parameter['a_half'], parameter['phi_age']) \
-            * cls.fitness_formula(-1, weight, parameter['w_half'], parameter['phi_weight'])
-        return fitness
+        return _kernels.fitness(age, weight, fitness_param_vec(parameter))
 
     @property
     def fitness(self):
         """
-        Method to return fitness of the animal. This is a property method so each time the weight
-        or age changes, the fitness is updated.
+        Method to return fitness of the animal. The fitness is cached and only recalculated after
+        the weight, the age or the animal parameters have changed.
 
         Returns
         -------
         Fitness of the animals
         """
-        if self.weight <= 0:
-            return 0
-        else:
-            return self.fitness_calculation(self.age, self.weight, self.parameter)
+        if self._fitness is None or self._fitness_version != Animal._parameter_version:
+            self._fitness = _kernels.fitness(self._age, self._weight, self._param_vec)
+            self._fitness_version = Animal._parameter_version
+        return self._fitness
+
+    @classmethod
+    def fitness_vector(cls, ages, weights):
+        """
+        Method to calculate the fitness of many animals of the class at once with the compiled
+            update_fitness kernel, which uses the same fitness kernel as the single animals.
+
+        Parameters
+        ----------
+        ages: numpy array
+        weights: numpy array
+
+        Returns
+        -------
+        Numpy array
+            The fitness of each animal, 0 for animals with weight <= 0.
+        """
+        ages = np.asarray(ages, dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+        return _kernels.update_fitness(ages, weights, np.empty_like(weights), cls._param_vec)
 
     @classmethod
     def set_params(cls, params):
@@ -95,6 +147,8 @@ class Animal:
 
         """
         cls.parameter.update(params)
+        Animal._parameter_version += 1
+        cls._recompute_constants()
 
     @classmethod
     def update_para(cls, params):
@@ -111,14 +165,31 @@ class Animal:
         for key in params.keys():
             if key not in cls.parameter.keys():
                 raise ValueError(f'"{key}" is not a parameter for animals ')
-            else:
-                cls.parameter[key] = params[key]
 
         for value in params.values():
             if value < 0:
                 raise ValueError(f'"{value}" < 0 , the parameter for animals must be larger than 0')
 
-    def procreate(self, N):
+        cls.set_params(params)
+
+    @classmethod
+    def _recompute_constants(cls):
+        """
+        Method to precompute the constants derived from the parameters of the class, so that they
+            are not recalculated from the parameter dictionary for every animal.
+
+        """
+        cls._log_mu = math.log(cls.parameter['w_birth'] ** 2 / (
+                cls.parameter['w_birth'] ** 2 + cls.parameter['sigma_birth'] ** 2) ** 0.5)
+        cls._log_sigma = math.log(1 + cls.parameter['sigma_birth'] ** 2
+                                  / cls.parameter['w_birth'] ** 2) ** 0.5
+        cls._birth_threshold = cls.parameter['zeta'] * (cls.parameter['w_birth']
+                                                        + cls.parameter['sigma_birth'])
+        cls._one_minus_eta = 1 - cls.parameter['eta']
+        cls._beta_F = cls.parameter['beta'] * cls.parameter['F']
+        cls._param_vec = fitness_param_vec(cls.parameter)
+
+    def procreate(self, N, rng):
         """Method to calculate if the animal has given birth. If the animal has given birth,
         it creates an instance of the class (object ) of Herbivore or the carnivore as baby animal.
 
@@ -130,22 +201,17 @@ class Animal:
         Parameters
         ----------
         N: N is the number of Herbivores in the cell at the start of the breeding season
+        rng: numpy.random.Generator
+            Generator to draw the birth and the baby weight from
 
         Returns
         -------
         Tuple
             Boolean value of animal has given birth or not and baby animal object
         """
-        log_mu = np.log(self.parameter['w_birth'] ** 2 / (
-                self.parameter['w_birth'] ** 2 + self.parameter['sigma_birth'] ** 2) ** 0.5)
-        log_sigma = np.log(1 + self.parameter['sigma_birth'] ** 2 / self.parameter['w_birth']
-                           ** 2) ** 0.5
-
         prob = min(1, self.parameter['gamma'] * self.fitness * N)
-        if (self.weight >= (self.parameter['w_birth'] + self.parameter['sigma_birth']) *
-            self.parameter['zeta']) \
-                & (self.age > 1) & (random.choices([False, True], [1 - prob, prob])[0]):
-            baby_weight = random.lognormvariate(log_mu, log_sigma)
+        if (self.weight >= self._birth_threshold) and (self.age > 1) and (rng.random() < prob):
+            baby_weight = rng.lognormal(self._log_mu, self._log_sigma)
             if self.weight - self.parameter['xi'] * baby_weight >= 0:
                 self.weight -= self.parameter['xi'] * baby_weight
                 baby_animal = self.__class__(0, baby_weight)
@@ -166,18 +232,23 @@ class Animal:
         weight * eta
 
         """
-        self.weight -= (self.weight * self.parameter['eta'])
+        self.weight *= self._one_minus_eta
 
         if self.weight < 0:
             self.weight = 0
 
-    def die(self):
+    def die(self, rng):
         """
         Method to decide if the animal die with certainty if weight is 0 and with a probability
 
         ..math::
             probability = omega * (1 - fitness)
 
+        Parameters
+        ----------
+        rng: numpy.random.Generator
+            Generator to draw the death from
+
         Returns
         -------
         True if animal dies and False if animals do not die.
@@ -186,42 +257,37 @@ class Animal:
             return True
         else:
             prob = self.parameter['omega'] * (1 - self.fitness)
-            return random.choices([False, True], [1 - prob, prob])[0]
+            return rng.random() < prob
 
-    def migrate(self, neighbors):
+    def migrate(self, neighbors, rng):
         """
-        Method to determine if the animal migrates. The animals migrate with probability
-        mu * fitness
-        Animals migrate to four adjacent cells at random with equal probability.
+        Method to determine if the animal migrates. The animal decides to move with probability
+        (mu * fitness) ** 2, i.e. it has to pass the mu * fitness chance twice, and then moves
+        to one of the four adjacent cells at random with equal probability.
 
         Parameters
         ----------
         neighbors
             list of cells where animals can migrate
+        rng: numpy.random.Generator
+            Generator to draw the move and its direction from
 
         Returns
         -------
         True if animals migrate otherwise false.
         """
-        self_fitness = self.fitness
-        prob = self_fitness * self.parameter['mu']
-        if random.choices([False, True], [1 - prob, prob])[0]:
-            if random.choices([False, True], [1 - prob, prob])[0]:
-                if len(neighbors) == 4:
-                    return random.choices(neighbors)[0]
-                if len(neighbors) == 3:
-                    return random.choices(neighbors + [False])[0]
-                if len(neighbors) == 2:
-                    return random.choices(neighbors + [False, False])[0]
-                if len(neighbors) == 1:
-                    return random.choices(neighbors + [False, False, False])[0]
-                if len(neighbors) == 0:
-                    return False
+        prob = self.fitness * self.parameter['mu']
+        if rng.random() < prob * prob:
+            # each of the four directions is chosen with equal probability, directions
+            # without an accessible cell mean the animal stays
+            idx = rng.integers(4)
+            return neighbors[idx] if idx < len(neighbors) else False
 
 
 class Herbivores(Animal):
     """ Herbivore animals eats fodder and can reside in the Lowland, Highland and Desert
             although Dessert does not have any fodder """
+    __slots__ = ()
 
     parameter = {'w_birth': 8.0, 'sigma_birth': 1.5, 'beta': 0.9, 'eta': 0.05,
                  'a_half': 40.0, 'phi_age': 0.6, 'w_half': 10.0, 'phi_weight': 0.1,
@@ -232,15 +298,13 @@ class Herbivores(Animal):
         """ Method to increase the weight of the herbivore after the animal eats. The weight of the
                 herbivore animal increases by beta * amount F of fodder """
 
-        self.weight += (self.parameter['beta'] * self.parameter['F'])
-
-    def __init(self, age=0, weight=None):
-        super().__init__(age, weight)
+        self.weight += self._beta_F
 
 
 class Carnivores(Animal):
     """ Carnivore animals hunts and eats Herbivores. Carnivores can reside in Desert, Lowland
             and Highland """
+    __slots__ = ()
 
     parameter = {'w_birth': 6.0, 'sigma_birth': 1.0, 'beta': 0.75, 'eta': 0.125,
                  'a_half': 40.0, 'phi_age': 0.3, 'w_half': 4.0, 'phi_weight': 0.4,
@@ -250,7 +314,7 @@ class Carnivores(Animal):
     def __init__(self, age=0, weight=None):
         super().__init__(age, weight)
 
-    def hunt(self, animal_list):
+    def hunt(self, animal_list, rng):
         """ Method to determine the list of the herbivore animals that can be hunted. Carnivore
             animal hunts herbivores in the order of the least fitness.
 
@@ -258,6 +322,8 @@ class Carnivores(Animal):
        ----------
        animal_list : list
         Herbivore list in the cell in weight ascending order
+       rng : numpy.random.Generator
+        Generator to draw the kills from
 
        Returns
        -------
@@ -272,12 +338,12 @@ class Carnivores(Animal):
                 prob = 0
             elif 0 < fit - animal_fitness < self.parameter['DeltaPhiMax']:
                 prob = (fit - animal_fitness) / self.parameter['DeltaPhiMax']
-            if random.choices([False, True], [1 - prob, prob])[0]:
+            if rng.random() < prob:
                 hunt_list.append(animal)
 
         return hunt_list
 
-    def eat(self, animal_list):
+    def eat(self, animal_list, rng):
         """
         Method to get the list of herbivore animals that are eaten by carnivore animals. The weight
             of the carnivore animal increases by beta * amount F. The carnivore will continue to
@@ -292,24 +358,36 @@ class Carnivores(Animal):
         ----------
         animal_list: list
             Herbivore animal list in a cell
+        rng: numpy.random.Generator
+            Generator to draw the kills from
 
         Returns
         -------
         List of Herbivore animals that are eaten
         """
 
-        hunt_list = self.hunt(animal_list)
-        hunt_weight_list = [animal.weight for animal in hunt_list]
-        cum_weight_list = np.cumsum(hunt_weight_list)
-        if len(cum_weight_list) < 2:
-            eaten_animal_list = hunt_list
-            self.weight += self.parameter['beta'] * sum(cum_weight_list)
-        elif self.parameter['F'] > cum_weight_list[-2]:
-            eaten_animal_list = hunt_list
-            self.weight += self.parameter['beta'] * cum_weight_list[-1]
+        hunt_list = self.hunt(animal_list, rng)
+        if len(hunt_list) == 0:
+            return hunt_list
+        # the first herbivore which makes the eaten amount reach F is the last one eaten
+        if len(hunt_list) > _NUMPY_EAT_MIN_LENGTH:
+            cum_weight = np.fromiter((animal.weight for animal in hunt_list), dtype=np.float64,
+                                     count=len(hunt_list))
+            np.cumsum(cum_weight, out=cum_weight)
+            stop_eat_index = min(np.searchsorted(cum_weight, self.parameter['F'], side='left'),
+                                 len(hunt_list) - 1)
+            eaten_weight = cum_weight[stop_eat_index]
         else:
-            stop_eat_index = np.searchsorted(cum_weight_list, self.parameter['F'], side='left')
-            eaten_animal_list = hunt_list[:stop_eat_index + 1]
-            self.weight += self.parameter['beta'] * cum_weight_list[stop_eat_index]
+            eaten_weight = 0
+            for stop_eat_index, animal in enumerate(hunt_list):
+                eaten_weight += animal.weight
+                if eaten_weight >= self.parameter['F']:
+                    break
+        eaten_animal_list = hunt_list[:stop_eat_index + 1]
+        self.weight += self.parameter['beta'] * eaten_weight
 
         return eaten_animal_list
+
+
+Herbivores._recompute_constants()
+Carnivores._recompute_constants()
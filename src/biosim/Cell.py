@@ -5,13 +5,16 @@ The Animal class with Herbivores and Carnivores as subclasses of Animal.
 __author__ = 'Hongpeng Zhang and Sujan Devkota'
 __email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
 
-import random
+import numpy as np
+from biosim import Animal, _kernels
 
 
 class Cell:
     """
     Class Cell for one landscape type where animals reside.
     """
+    __slots__ = ('_fodder', '_fodder_idx', 'geography', 'animal_list', 'Carnivores_list', 'rng',
+                 '_fitness_h', '_ages_h', '_weights_h', '_fitness_c', '_ages_c', '_weights_c')
     ParamCell = {'f_max_L': 800, 'f_max_H': 300}
 
     @classmethod
@@ -33,7 +36,7 @@ class Cell:
             if landscape == 'H':
                 cls.ParamCell['f_max_H'] = params['f_max']
 
-    def __init__(self, geography, fodder=0, animal_list=None, Carnivores_list=None):
+    def __init__(self, geography, fodder=0, animal_list=None, Carnivores_list=None, rng=None):
         """
         Constructor for class Cell.
 
@@ -46,6 +49,8 @@ class Cell:
             Herbivore list
         Carnivores_list: list
             Carnivore list
+        rng: numpy.random.Generator
+            Random number stream of the cell, a new unseeded one if None
 
         Notes
         -----
@@ -56,10 +61,107 @@ class Cell:
              geography_dict = {'W': 'Water', 'L': 'Lowland', 'H': 'Highland', 'D': 'Desert'}
 
         """
-        self.fodder = fodder
+        # the fodder is an element of an array, so a map can point it into its fodder array
+        self._fodder = np.array([fodder], dtype=np.float64)
+        self._fodder_idx = 0
         self.geography = geography
         self.animal_list = animal_list if animal_list is not None else []
         self.Carnivores_list = Carnivores_list if Carnivores_list is not None else []
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # fitness, age and weight arrays of the animals alive at the end of the year, stashed by
+        # grow_loss_and_death for the yearly statistics
+        self._fitness_h = self._ages_h = self._weights_h = np.empty(0, dtype=np.float64)
+        self._fitness_c = self._ages_c = self._weights_c = np.empty(0, dtype=np.float64)
+
+    @property
+    def fodder(self):
+        """Amount of fodder in the cell."""
+        return float(self._fodder[self._fodder_idx])
+
+    @fodder.setter
+    def fodder(self, value):
+        self._fodder[self._fodder_idx] = value
+
+    @staticmethod
+    def animal_arrays(animal_list):
+        """
+        Method to collect the ages and the weights of the animals into numpy arrays.
+
+        Parameters
+        ----------
+        animal_list: list
+
+        Returns
+        -------
+        Tuple
+            Numpy arrays of the ages and the weights of the animals
+        """
+        n = len(animal_list)
+        ages = np.fromiter(map(Animal.age_getter, animal_list), dtype=np.float64, count=n)
+        weights = np.fromiter(map(Animal.weight_getter, animal_list), dtype=np.float64, count=n)
+        return ages, weights
+
+    @staticmethod
+    def animal_fitness(ages, weights, species):
+        """
+        Method to calculate the fitness of animals of one species from their age and weight
+            arrays with the compiled update_fitness kernel.
+
+        Parameters
+        ----------
+        ages: numpy array
+        weights: numpy array
+        species: class
+            Animal.Herbivores or Animal.Carnivores
+
+        Returns
+        -------
+        Numpy array
+            The fitness of each animal
+        """
+        return _kernels.update_fitness(ages, weights, np.empty_like(weights), species._param_vec)
+
+    def animals_birth(self, animal_list, species):
+        """
+        Method to decide for all animals of one species in the cell at once if they give birth.
+            The birth probabilities and the baby weights are drawn with one numpy call each, the
+            rules are the same as in Animal.procreate.
+
+        Parameters
+        ----------
+        animal_list: list
+            Animals of the species in the cell at the start of the breeding season
+        species: class
+            Herbivores or Carnivores
+
+        Returns
+        -------
+        List
+            Baby animal list
+        """
+        n = len(animal_list)
+        if n == 0:
+            return []
+        param = species.parameter
+        ages, weights = self.animal_arrays(animal_list)
+        prob = np.minimum(1, param['gamma'] * species.fitness_vector(ages, weights) * n)
+        can_birth = (weights >= species._birth_threshold) & (ages > 1)
+        mothers = np.flatnonzero(can_birth & (self.rng.random(n) < prob))
+        if len(mothers) == 0:
+            return []
+
+        baby_weights = self.rng.lognormal(species._log_mu, species._log_sigma,
+                                          size=len(mothers))
+        weight_loss = param['xi'] * baby_weights
+        enough_weight = weights[mothers] - weight_loss >= 0
+
+        baby_animal_list = []
+        for i, baby_weight, loss in zip(mothers[enough_weight], baby_weights[enough_weight],
+                                        weight_loss[enough_weight]):
+            animal_list[i].weight -= loss
+            baby_animal_list.append(species(0, float(baby_weight)))
+
+        return baby_animal_list
 
     def produce_fodder(self):
         """
@@ -82,12 +184,8 @@ class Cell:
         List
             Baby herbivore animal list
         """
-        baby_animal_list = []
-        for animal in self.animal_list:
-            baby = animal.procreate(len(self.animal_list))
-            if baby[0]:
-                baby_animal_list.append(baby[1])
-        self.animal_list += baby_animal_list
+        baby_animal_list = self.animals_birth(self.animal_list, Animal.Herbivores)
+        self.animal_list.extend(baby_animal_list)
 
         return baby_animal_list
 
@@ -100,12 +198,8 @@ class Cell:
         List
             Baby herbivore animal list
         """
-        baby_animal_list = []
-        for animal in self.Carnivores_list:
-            baby = animal.procreate(len(self.Carnivores_list))
-            if baby[0]:
-                baby_animal_list.append(baby[1])
-        self.Carnivores_list += baby_animal_list
+        baby_animal_list = self.animals_birth(self.Carnivores_list, Animal.Carnivores)
+        self.Carnivores_list.extend(baby_animal_list)
 
         return baby_animal_list
 
@@ -113,35 +207,51 @@ class Cell:
         """
         Method to feed herbivore animals in the random order and stop when the fodder is not enough
 
+        Notes
+        -----
+        - All herbivores eat the same amount F, so the number of herbivores that can eat is known
+          beforehand, and the list only has to be shuffled if not all of them get fodder.
+
         """
-        random.shuffle(self.animal_list)
-        for animal in self.animal_list:
-            if self.fodder >= animal.parameter['F']:
-                animal.eat()
-                self.fodder -= animal.parameter['F']
-            else:
-                break
+        F = Animal.Herbivores.parameter['F']
+        if (len(self.animal_list) == 0) | (self.fodder < F):
+            return
+        if F > 0:
+            num_eat = min(len(self.animal_list), int(self.fodder // F))
+        else:
+            num_eat = len(self.animal_list)
+        if num_eat < len(self.animal_list):
+            self.rng.shuffle(self.animal_list)
+        for animal in self.animal_list[:num_eat]:
+            animal.eat()
+        self.fodder -= num_eat * F
 
     def feed_carnivores(self):
         """
-        Method to feed carnivores.
+        Method to feed carnivores. The hunting runs in the compiled hunt_step kernel on the
+            fitness and weight arrays of the animals in the cell.
 
         """
-        if len(self.Carnivores_list) > 0:
-            carnivore_hunting_order_list = sorted({animal: animal.weight for animal in
-                                                   self.Carnivores_list}.items(),
-                                                  key=lambda x: x[1], reverse=True)
-            self.Carnivores_list = [item[0] for item in carnivore_hunting_order_list]
-            for animal in self.Carnivores_list:
-                # Herbivores hunted in weight descending order
-                herbivore_hunted_order_list = sorted({animal: animal.weight for animal in
-                                                      self.animal_list}.items(), key=lambda x: x[1])
-                self.animal_list = [item[0] for item in herbivore_hunted_order_list]
-                eaten_herbivores = animal.eat(self.animal_list)
-
-                if len(eaten_herbivores) > 0:
-                    for herbivores in eaten_herbivores:
-                        self.animal_list.remove(herbivores)
+        if (len(self.Carnivores_list) > 0) & (len(self.animal_list) > 0):
+            # Carnivores hunt in weight descending order
+            self.Carnivores_list.sort(key=Animal.weight_getter, reverse=True)
+            # Herbivores hunted in weight ascending order
+            self.animal_list.sort(key=Animal.weight_getter)
+            h_age, h_weight = self.animal_arrays(self.animal_list)
+            c_age, c_weight = self.animal_arrays(self.Carnivores_list)
+            c_weight_before = c_weight.copy()
+            param = Animal.Carnivores.parameter
+            eaten = _kernels.hunt_step(
+                self.animal_fitness(c_age, c_weight, Animal.Carnivores), c_weight,
+                self.animal_fitness(h_age, h_weight, Animal.Herbivores), h_weight,
+                param['F'], param['beta'], param['DeltaPhiMax'],
+                self.rng.random((len(self.Carnivores_list), len(self.animal_list))))
+
+            for i in np.flatnonzero(c_weight != c_weight_before):
+                self.Carnivores_list[i].weight = float(c_weight[i])
+            if eaten.any():
+                self.animal_list = [herbivore for herbivore, is_eaten in
+                                    zip(self.animal_list, eaten) if not is_eaten]
         else:
             pass
 
@@ -151,9 +261,7 @@ class Cell:
             herbivore animal in a cell.
 
         """
-        for animal in self.animal_list:
-            animal.growth_per_year()
-            animal.weight_loss_per_year()
+        self.grow_and_loose_weight(self.animal_list, Animal.Herbivores)
 
     def grow_and_loose_weight_carnivore(self):
         """
@@ -161,9 +269,93 @@ class Cell:
             carnivore animal in a cell.
 
         """
-        for animal in self.Carnivores_list:
-            animal.growth_per_year()
-            animal.weight_loss_per_year()
+        self.grow_and_loose_weight(self.Carnivores_list, Animal.Carnivores)
+
+    @staticmethod
+    def grow_and_loose_weight(animal_list, species):
+        """
+        Method to increase the age and decrease the weight of all animals of one species in a
+            cell in one pass of the compiled grow_loss kernel.
+
+        Parameters
+        ----------
+        animal_list: list
+        species: class
+            Animal.Herbivores or Animal.Carnivores
+
+        Returns
+        -------
+        Numpy array
+            The fitness of each animal after the year
+        """
+        ages, weights = Cell.animal_arrays(animal_list)
+        fitness = _kernels.grow_loss(ages, weights, np.empty_like(weights),
+                                     species.parameter['eta'], species._param_vec)
+        for animal, weight in zip(animal_list, weights):
+            animal.age += 1
+            animal.weight = float(weight)
+
+        return fitness
+
+    def grow_loss_and_death(self):
+        """
+        Method to do the end of year steps for herbivores and carnivores in the cell at once: the
+            same as grow_and_loose_weight_herbivore, grow_and_loose_weight_carnivore,
+            herbivore_death and carnivore_death, computed by the compiled age_and_die kernel.
+
+        Returns
+        -------
+        Tuple
+            The lists of died herbivores and died carnivores
+
+        Notes
+        -----
+        - The fitness, age and weight arrays of the surviving animals are stashed on the cell as
+          _fitness_h, _ages_h, _weights_h and _fitness_c, _ages_c, _weights_c.
+        """
+        self.animal_list, died_animal_list, self._ages_h, self._weights_h, self._fitness_h = \
+            self.animals_aging_and_death(self.animal_list, Animal.Herbivores)
+        self.Carnivores_list, died_carnivores_list, self._ages_c, self._weights_c, \
+            self._fitness_c = self.animals_aging_and_death(self.Carnivores_list, Animal.Carnivores)
+
+        return died_animal_list, died_carnivores_list
+
+    def animals_aging_and_death(self, animal_list, species):
+        """
+        Method to age, lose weight and decide the death of all animals of one species in the cell.
+
+        Parameters
+        ----------
+        animal_list: list
+        species: class
+            Herbivores or Carnivores
+
+        Returns
+        -------
+        Tuple
+            List of the surviving animals, list of the died animals and the age, weight and
+            fitness arrays of the surviving animals after the year
+        """
+        if len(animal_list) == 0:
+            return animal_list, [], np.empty(0), np.empty(0), np.empty(0)
+        param = species.parameter
+        ages, weights = self.animal_arrays(animal_list)
+        fitness = np.empty_like(weights)
+        dies = _kernels.age_and_die(ages, weights, fitness, param['eta'], param['omega'],
+                                    species._param_vec, self.rng.random(len(animal_list)))
+
+        stay_animal_list = []
+        died_animal_list = []
+        for animal, weight, die in zip(animal_list, weights, dies):
+            animal.age += 1
+            animal.weight = float(weight)
+            if die:
+                died_animal_list.append(animal)
+            else:
+                stay_animal_list.append(animal)
+
+        stays = ~dies
+        return stay_animal_list, died_animal_list, ages[stays], weights[stays], fitness[stays]
 
     def herbivore_death(self):
         """
@@ -176,13 +368,8 @@ class Cell:
             The list of died herbivore animals
 
         """
-        died_animal_list = []
-        for animal in self.animal_list:
-            if animal.die():
-                died_animal_list.append(animal)
-        if len(died_animal_list) > 0:
-            for animal in died_animal_list:
-                self.animal_list.remove(animal)
+        self.animal_list, died_animal_list = self.animals_death(self.animal_list,
+                                                                Animal.Herbivores)
 
         return died_animal_list
 
@@ -197,17 +384,68 @@ class Cell:
            The list of died carnivore animals
 
         """
-        died_carnivores_list = []
-        for animal in self.Carnivores_list:
-            if animal.die():
-                died_carnivores_list.append(animal)
-        if len(died_carnivores_list) > 0:
-            for animal in died_carnivores_list:
-                self.Carnivores_list.remove(animal)
+        self.Carnivores_list, died_carnivores_list = self.animals_death(self.Carnivores_list,
+                                                                        Animal.Carnivores)
 
         return died_carnivores_list
 
-    def animal_migration(self, neighbors):
+    @staticmethod
+    def death_probability(ages, weights, species):
+        """
+        Method to calculate the probability to die of animals of one species: 1 for animals with
+            weight 0, omega * (1 - fitness) for the others.
+
+        Parameters
+        ----------
+        ages: numpy array
+        weights: numpy array
+        species: class
+            Herbivores or Carnivores
+
+        Returns
+        -------
+        Numpy array
+            The probability to die of each animal
+        """
+        prob = species.parameter['omega'] * (1 - species.fitness_vector(ages, weights))
+        prob[weights <= 0] = 1
+        return prob
+
+    def animals_death(self, animal_list, species):
+        """
+        Method to decide for all animals of one species in the cell at once if they die. Animals
+            with weight 0 die with certainty, the others with probability omega * (1 - fitness),
+            drawn with one numpy call.
+
+        Parameters
+        ----------
+        animal_list: list
+        species: class
+            Herbivores or Carnivores
+
+        Returns
+        -------
+        Tuple
+            List of the surviving animals and list of the died animals
+        """
+        if len(animal_list) == 0:
+            return animal_list, []
+        dies = self.rng.random(len(animal_list)) < self.death_probability(
+            *self.animal_arrays(animal_list), species)
+        if not dies.any():
+            return animal_list, []
+
+        stay_animal_list = []
+        died_animal_list = []
+        for animal, die in zip(animal_list, dies):
+            if die:
+                died_animal_list.append(animal)
+            else:
+                stay_animal_list.append(animal)
+
+        return stay_animal_list, died_animal_list
+
+    def animal_migration(self, neighbors, year):
         """
         Method to check if the animal wants to migrate. If the animal wants to stay, then the method
             updates the animal in the stay list for both herbivores and carnivores in a particular
@@ -216,30 +454,63 @@ class Cell:
         Parameters
         ----------
         neighbors: list
+        year: int
+            The migration season, animals which already moved in this season stay
 
         """
+        self.animal_list, moving_animals = self.animals_migration(
+            self.animal_list, Animal.Herbivores, neighbors, year)
+        for animal, destination in moving_animals:
+            destination.animal_list.append(animal)
+
+        self.Carnivores_list, moving_carnivores = self.animals_migration(
+            self.Carnivores_list, Animal.Carnivores, neighbors, year)
+        for animal, destination in moving_carnivores:
+            destination.Carnivores_list.append(animal)
+
+    def animals_migration(self, animal_list, species, neighbors, year):
+        """
+        Method to decide for all animals of one species in the cell at once if they migrate and
+            where to. Animals which have not moved this year migrate with the same probability as
+            in Animal.migrate, (mu * fitness) ** 2, the decisions and directions are drawn with
+            one numpy call each.
+
+        Parameters
+        ----------
+        animal_list: list
+        species: class
+            Herbivores or Carnivores
+        neighbors: list
+            Accessible neighbor cells
+        year: int
+            The migration season
+
+        Returns
+        -------
+        Tuple
+            List of the animals staying and list of (animal, destination cell) pairs
+        """
+        n = len(animal_list)
+        if (n == 0) | (len(neighbors) == 0):
+            return animal_list, []
+        moved = np.fromiter(map(Animal.moved_year_getter, animal_list), dtype=np.int64,
+                            count=n) == year
+        ages, weights = self.animal_arrays(animal_list)
+        prob = (species.parameter['mu'] * species.fitness_vector(ages, weights)) ** 2
+        # each of the four directions is chosen with equal probability, directions without an
+        # accessible cell mean the animal stays
+        direction = self.rng.integers(0, 4, n)
+        move = ~moved & (self.rng.random(n) < prob) & (direction < len(neighbors))
+        if not move.any():
+            return animal_list, []
+
         stay_animal_list = []
-        stay_carnivores_list = []
-        for animal in self.animal_list:
-            if animal.moved:
-                stay_animal_list.append(animal)
+        moving_animals = []
+        for animal, animal_move, animal_direction in zip(animal_list, move, direction):
+            if animal_move:
+                animal.moved_year = year
+                moving_animals.append((animal, neighbors[animal_direction]))
             else:
-                destination = animal.migrate(neighbors)
-                if destination:
-                    animal.moved = True
-                    destination.animal_list.append(animal)
-                else:
-                    stay_animal_list.append(animal)
-        self.animal_list = stay_animal_list
-
-        for animal in self.Carnivores_list:
-            if animal.moved:
-                stay_carnivores_list.append(animal)
-            else:
-                destination = animal.migrate(neighbors)
-                if destination:
-                    animal.moved = True
-                    destination.Carnivores_list.append(animal)
-                else:
-                    stay_carnivores_list.append(animal)
-        self.Carnivores_list = stay_carnivores_list
+                stay_animal_list.append(animal)
+
+        return stay_animal_list, moving_animals
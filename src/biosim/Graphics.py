@@ -14,6 +14,7 @@ import numpy as np
 import textwrap
 import subprocess
 import os
+import weakref
 from pathlib import Path
 
 # Update these variables to point to your ffmpeg and convert binaries
@@ -29,6 +30,69 @@ _DEFAULT_GRAPHICS_NAME = 'dv'
 _DEFAULT_IMG_FORMAT = 'png'
 _DEFAULT_MOVIE_FORMAT = 'mp4'  # alternatives: mp4, gif
 
+# the frames are only read back by ffmpeg, so they are saved at screen resolution with fast
+# PNG compression
+_IMG_DPI = 72
+_PNG_PIL_KWARGS = {'compress_level': 1, 'optimize': False}
+
+
+def _close_ffmpeg(ffproc):
+    """
+    Close the stdin of a streaming ffmpeg process and wait for it to finish the movie.
+
+    Parameters
+    ----------
+    ffproc: subprocess.Popen
+        The ffmpeg process reading the frames from its stdin
+
+    Returns
+    -------
+    int
+        The exit status of ffmpeg
+    """
+    if not ffproc.stdin.closed:
+        ffproc.stdin.close()
+    return ffproc.wait()
+
+
+def _fast_uhist(values, bin_edges, groups=None, n_groups=1):
+    """
+    Histogram on uniform bins with a single bincount instead of the searchsorted used by
+    np.histogram. The bin of each value is guessed from the bin width and moved to the
+    neighbouring bin where rounding put it on the wrong side of the real edge, so the counts
+    are the counts of np.histogram on the same bin_edges.
+
+    Parameters
+    ----------
+    values: array_like
+        The values to be counted
+    bin_edges: numpy array
+        The uniformly spaced bin edges, the last bin is closed like in np.histogram
+    groups: array_like of int
+        Optional group number (0 to n_groups - 1) of each value, to count several
+        histograms on the same bins in one pass
+    n_groups: int
+        The amount of groups
+
+    Returns
+    -------
+    Numpy array
+        The counts of each bin, the histograms of the groups one after another,
+        values outside the bins are dropped as in np.histogram
+    """
+    nbins = len(bin_edges) - 1
+    values = np.asarray(values, dtype=np.float64)
+    keep = (values >= bin_edges[0]) & (values <= bin_edges[-1])
+    kept = values[keep]
+    scaled = (kept - bin_edges[0]) * (nbins / (bin_edges[-1] - bin_edges[0]))
+    idx = np.minimum(scaled.astype(np.intp), nbins - 1)
+    # fix up the values rounded into the bin next to theirs
+    idx -= kept < bin_edges[idx]
+    idx += (kept >= bin_edges[idx + 1]) & (idx < nbins - 1)
+    if groups is not None:
+        idx += np.asarray(groups, dtype=np.intp)[keep] * nbins
+    return np.bincount(idx, minlength=n_groups * nbins)
+
 
 class Graphics:
     """Provides graphics support for BioSim."""
@@ -38,7 +102,7 @@ class Graphics:
                  'D': (1.0, 1.0, 0.5)}  # light yellow
 
     def __init__(self, island_map, img_dir=None, img_base=None,
-                 img_fmt=None, hist_specs=None, ymax_animals=None):
+                 img_fmt=None, hist_specs=None, ymax_animals=None, movie_stream=False):
         """
 
         Parameters
@@ -55,6 +119,9 @@ class Graphics:
             The maximum of x-axis and the bin width for the histogram.
         ymax_animals: int or float
             The maximum of y-axis of the amount of fauna axes
+        movie_stream: bool
+            If True, the frames are piped straight into an ffmpeg process writing the mp4
+            movie instead of being saved as image files, make_movie then only finishes it.
         """
 
         if img_base is None:
@@ -82,6 +149,9 @@ class Graphics:
         self.bin_edges_weight = np.arange(0, self.bin_max['weight'] + self.bin_width['weight'] / 2,
                                           self.bin_width['weight'])
         self.hist_counts_weight = np.zeros_like(self.bin_edges_weight[:-1], dtype=float)
+        # the bins are uniform, so the histograms can use _fast_uhist
+        self._bin_edges = {'fitness': self.bin_edges_fitness, 'age': self.bin_edges_age,
+                           'weight': self.bin_edges_weight}
 
         self.img_dir = img_dir
         self.img_base = img_base
@@ -90,6 +160,8 @@ class Graphics:
 
         self.island_map = island_map
         self._img_ctr = 0
+        self._movie_stream = movie_stream
+        self._ffproc = None  # the ffmpeg process the frames are streamed to
         self._img_years = 1
 
         # the following will be initialized by _setup_graphics
@@ -100,10 +172,13 @@ class Graphics:
         # year counter
         self._ax_year = None
         self._year_text = None
+        self._shown_year = 0  # the year the year counter text shows
         # fauna amount line
         self._ax_amount = None
         self._h_line = None
         self._c_line = None
+        self._h_ydata = None
+        self._c_ydata = None
         # herbivores distribute colormap
         self._ax_h_distribute = None
         self._h_distribute_cmap = None
@@ -125,8 +200,14 @@ class Graphics:
 
         island_map = textwrap.dedent(self.island_map)
 
-        self.map_rgb = [[Graphics.rgb_value[column] for column in row]
-                        for row in island_map.splitlines()]
+        # uint8 colours looked up by the ASCII code of the landscape letter
+        rgb_lut = np.zeros((256, 3), dtype=np.uint8)
+        for letter, rgb in Graphics.rgb_value.items():
+            rgb_lut[ord(letter)] = np.rint(np.array(rgb) * 255)
+        rows = island_map.splitlines()
+        letters = np.frombuffer(''.join(rows).encode('ascii'), dtype=np.uint8)
+        self.map_rgb = rgb_lut[letters.reshape(len(rows), len(rows[0]))]
+        self._map_shape = self.map_rgb.shape[:2]  # rows and columns of the island
 
     def setup(self, final_years, img_years, cmax_animals=None):
         """
@@ -156,6 +237,48 @@ class Graphics:
         self.add_fitness()
         self.add_age()
         self.add_weight()
+        # show the window without blocking, the figure is redrawn once per visualize call
+        plt.show(block=False)
+
+        if self._movie_stream and self._img_base is not None and self._ffproc is None:
+            self._start_movie_stream()
+
+    def _start_movie_stream(self):
+        """Start the ffmpeg process reading raw RGBA frames of the figure from its stdin."""
+        width, height = self._fig.canvas.get_width_height(physical=True)
+        try:
+            self._ffproc = subprocess.Popen([_FFMPEG_BINARY,
+                                             '-f', 'rawvideo',
+                                             '-pix_fmt', 'rgba',
+                                             '-s', f'{width}x{height}',
+                                             '-framerate', '2',
+                                             '-i', '-',
+                                             '-y',
+                                             '-profile:v', 'baseline',
+                                             '-level', '3.0',
+                                             '-r', '2',
+                                             '-pix_fmt', 'yuv420p',
+                                             '{}.{}'.format(self.img_base, 'mp4')],
+                                            stdin=subprocess.PIPE, bufsize=1 << 20)
+        except OSError as err:
+            raise RuntimeError('ERROR: ffmpeg failed with: {}'.format(err))
+        # finish the movie and reap ffmpeg when the graphics are closed, garbage collected or
+        # the interpreter exits without make_movie
+        self._ffproc_finalizer = weakref.finalize(self, _close_ffmpeg, self._ffproc)
+
+    def close(self):
+        """
+        Finish the streamed movie and wait for ffmpeg, if the frames are streamed.
+
+        Returns
+        -------
+        int or None
+            The exit status of ffmpeg, None if no frames were streamed
+        """
+        if self._ffproc is None:
+            return None
+        self._ffproc = None
+        return self._ffproc_finalizer()
 
     def add_map(self):
         """Add island map into the figure"""
@@ -165,10 +288,11 @@ class Graphics:
 
             self._ax_map.imshow(self.map_rgb)
 
-            self._ax_map.set_xticks(range(len(self.map_rgb[0])))
-            self._ax_map.set_xticklabels(range(1, 1 + len(self.map_rgb[0])))
-            self._ax_map.set_yticks(range(len(self.map_rgb)))
-            self._ax_map.set_yticklabels(range(1, 1 + len(self.map_rgb)))
+            y, x = self._map_shape
+            self._ax_map.set_xticks(range(x))
+            self._ax_map.set_xticklabels(range(1, 1 + x))
+            self._ax_map.set_yticks(range(y))
+            self._ax_map.set_yticklabels(range(1, 1 + y))
             self._ax_map.set_title('Map of Rossumøya')
             self._ax_map.axis('off')
 
@@ -194,6 +318,7 @@ class Graphics:
                                                  horizontalalignment='center',
                                                  verticalalignment='center',
                                                  transform=self._ax_year.transAxes, fontsize=15)
+            self._shown_year = 0
 
     def add_fauna_amount(self, final_years):
         """Add the fauna amount axes into the figure."""
@@ -207,27 +332,26 @@ class Graphics:
         self._ax_amount.set_xlabel('year')
         self._ax_amount.set_ylabel('Num of Fauna')
         # self._ax_amount.legend()
+        # the yearly amounts are written into these buffers, which only grow when a later
+        # simulate call goes beyond the years they cover
+        if self._h_ydata is None or len(self._h_ydata) < final_years + 1:
+            h_ydata = np.full(final_years + 1, np.nan)
+            c_ydata = np.full(final_years + 1, np.nan)
+            if self._h_ydata is not None:
+                h_ydata[:len(self._h_ydata)] = self._h_ydata
+                c_ydata[:len(self._c_ydata)] = self._c_ydata
+            self._h_ydata, self._c_ydata = h_ydata, c_ydata
+        x_data = np.arange(len(self._h_ydata))
         if self._h_line is None:
-            self._h_line = self._ax_amount.plot(
-                np.arange(0, final_years + 1), np.full(final_years + 1, np.nan),
-                'b.', label='Herbivores')[0]
+            self._h_line = self._ax_amount.plot(x_data, self._h_ydata,
+                                                'b.', label='Herbivores')[0]
+        else:
+            self._h_line.set_data(x_data, self._h_ydata)
         if self._c_line is None:
-            self._c_line = self._ax_amount.plot(
-                np.arange(0, final_years + 1), np.full(final_years + 1, np.nan),
-                'r.', label='Carnivores')[0]
+            self._c_line = self._ax_amount.plot(x_data, self._c_ydata,
+                                                'r.', label='Carnivores')[0]
         else:
-            x_data_h, y_data_h = self._h_line.get_data()
-            x_data_c, y_data_c = self._c_line.get_data()
-            xnew_h = np.arange(x_data_h[-1] + 1, final_years)
-            xnew_c = np.arange(x_data_c[-1] + 1, final_years)
-            ynew_h = np.full(xnew_h.shape, np.nan)
-            ynew_c = np.full(xnew_c.shape, np.nan)
-            x_stack_h = np.hstack((x_data_h, xnew_h))
-            x_stack_c = np.hstack((x_data_c, xnew_c))
-            y_stack_h = np.hstack((y_data_h, ynew_h))
-            y_stack_c = np.hstack((y_data_c, ynew_c))
-            self._h_line.set_data((x_stack_h, y_stack_h))
-            self._c_line.set_data((x_stack_c, y_stack_c))
+            self._c_line.set_data(x_data, self._c_ydata)
 
     def add_herbivores_distribute(self, cmax_animals):
         """Add the herbivores distribute colormap into the figure."""
@@ -238,9 +362,15 @@ class Graphics:
                 cm_h_max = 100
             self._ax_h_distribute = self._fig.add_axes([0.25, 0.35, 0.25, 0.25])
             self._h_distribute_cmap = self._ax_h_distribute.imshow(
-                np.zeros(np.array(self.map_rgb).shape),
+                np.zeros(self._map_shape),
                 interpolation='nearest', vmin=0, vmax=cm_h_max)
             plt.colorbar(self._h_distribute_cmap, ax=self._ax_h_distribute, shrink=0.7)
+            y, x = self._map_shape
+            self._ax_h_distribute.set_xticks(range(0, x, 5))
+            self._ax_h_distribute.set_xticklabels(range(0, x, 5))
+            self._ax_h_distribute.set_yticks(range(0, y, 5))
+            self._ax_h_distribute.set_yticklabels(range(0, y, 5))
+            self._ax_h_distribute.set_title('Herbivore Distribution')
 
     def add_carnivores_distribute(self, cmax_animals):
         """Add the carnivores distribute colormap into the figure."""
@@ -251,9 +381,15 @@ class Graphics:
                 cm_c_max = 100
             self._ax_c_distribute = self._fig.add_axes([0.6, 0.35, 0.25, 0.25])
             self._c_distribute_cmap = self._ax_c_distribute.imshow(
-                np.zeros(np.array(self.map_rgb).shape), interpolation='nearest',
+                np.zeros(self._map_shape), interpolation='nearest',
                 vmin=0, vmax=cm_c_max)
             plt.colorbar(self._c_distribute_cmap, ax=self._ax_c_distribute, shrink=0.7)
+            y, x = self._map_shape
+            self._ax_c_distribute.set_xticks(range(0, x, 5))
+            self._ax_c_distribute.set_xticklabels(range(0, x, 5))
+            self._ax_c_distribute.set_yticks(range(0, y, 5))
+            self._ax_c_distribute.set_yticklabels(range(0, y, 5))
+            self._ax_c_distribute.set_title('Carnivores Distribution')
 
     def add_fitness(self):
         """Add the fitness histogram into the figure."""
@@ -301,77 +437,78 @@ class Graphics:
                 self.hist_counts_weight, self.bin_edges_weight,
                 color='r', lw=2, label='Carnivores')
 
+    def visualize(self, year, h_num, c_num, h_distribute, c_distribute, h_stats, c_stats):
+        """
+        Update the whole figure for one year and redraw it once.
+
+        Parameters
+        ----------
+        year: int
+            The year to be shown
+        h_num: int
+            The amount of herbivores
+        c_num: int
+            The amount of carnivores
+        h_distribute: numpy array
+            The amount of herbivores in each cell
+        c_distribute: numpy array
+            The amount of carnivores in each cell
+        h_stats: dictionary
+            The fitness, age and weight values of the herbivores, keyed by the attribute name
+        c_stats: dictionary
+            The fitness, age and weight values of the carnivores, keyed by the attribute name
+        """
+        self.update_year_counter(year)
+        self.update_fauna_amount(year, h_num, c_num)
+        self.update_herbivores_distribute(h_distribute)
+        self.update_carnivores_distribute(c_distribute)
+        for attr in ('fitness', 'age', 'weight'):
+            self.update_hist(attr, h_stats[attr], c_stats[attr])
+        self._fig.canvas.draw_idle()
+        self._fig.canvas.flush_events()
+
     def update_year_counter(self, year):
         """update the year counter in the figure."""
-        self._year_text.set_text('Year: {:5d}'.format(year))
-        plt.pause(0.001)
+        if year != self._shown_year:
+            self._year_text.set_text('Year: {:5d}'.format(year))
+            self._shown_year = year
 
     def update_fauna_amount(self, year, h_num, c_num):
         """update the fauna_amount axes in the figure."""
-        ydata_h = self._h_line.get_ydata()
-        ydata_h[year] = h_num
-        self._h_line.set_ydata(ydata_h)
+        self._h_ydata[year] = h_num
+        self._h_line.set_ydata(self._h_ydata)
 
-        ydata_c = self._c_line.get_ydata()
-        ydata_c[year] = c_num
-        self._c_line.set_ydata(ydata_c)
-        plt.pause(0.001)
+        self._c_ydata[year] = c_num
+        self._c_line.set_ydata(self._c_ydata)
 
     def update_herbivores_distribute(self, distribution):
         """update the herbivores distribute colormap in the figure."""
-        y, x = np.array(self.map_rgb).shape[0], np.array(self.map_rgb).shape[1]
-        self._ax_h_distribute.imshow(distribution,
-                                     interpolation='nearest')
-        # plt.colorbar(h_num_axis, ax=self._ax_h_distribute)
-        self._ax_h_distribute.set_xticks(range(0, x, 5))
-        self._ax_h_distribute.set_xticklabels(range(0, x, 5))
-        self._ax_h_distribute.set_yticks(range(0, y, 5))
-        self._ax_h_distribute.set_yticklabels(range(0, y, 5))
-        self._ax_h_distribute.set_title('Herbivore Distribution')
-        # plt.colorbar(ax=self._ax_h_distribute)
-        plt.pause(0.001)
+        self._h_distribute_cmap.set_data(distribution)
 
     def update_carnivores_distribute(self, distribution):
         """update the carnivores distribute colormap in the figure."""
-        v_max = distribution.max()
-        v_min = distribution.min()
-        y, x = np.array(self.map_rgb).shape[0], np.array(self.map_rgb).shape[1]
-        self._ax_c_distribute.imshow(distribution,
-                                     interpolation='nearest',
-                                     vmin=v_min, vmax=v_max)
-        self._ax_c_distribute.set_xticks(range(0, x, 5))
-        self._ax_c_distribute.set_xticklabels(range(0, x, 5))
-        self._ax_c_distribute.set_yticks(range(0, y, 5))
-        self._ax_c_distribute.set_yticklabels(range(0, y, 5))
-        self._ax_c_distribute.set_title('Carnivores Distribution')
-        plt.pause(0.001)
-
-    def update_fitness(self, year, h_fitness_list, c_fitness_list):
-        """update the fitness distribute histogram in the figure."""
-        hist_counts_h, _ = np.histogram(h_fitness_list, self.bin_edges_fitness)
-        self._fitness_stair_h.set_data(hist_counts_h)
-
-        hist_counts_c, _ = np.histogram(c_fitness_list, self.bin_edges_fitness)
-        self._fitness_stair_c.set_data(hist_counts_c)
-        plt.pause(0.001)
-
-    def update_age(self, year, h_age_list, c_age_list):
-        """update the age distribute histogram in the figure."""
-        hist_counts_h, _ = np.histogram(h_age_list, self.bin_edges_age)
-        self._age_stair_h.set_data(hist_counts_h)
-
-        hist_counts_c, _ = np.histogram(c_age_list, self.bin_edges_age)
-        self._age_stair_c.set_data(hist_counts_c)
-        plt.pause(0.001)
-
-    def update_weight(self, year, h_weight_list, c_weight_list):
-        """update the weight distribute histogram in the figure."""
-        hist_counts_h, _ = np.histogram(h_weight_list, self.bin_edges_weight)
-        self._weight_stair_h.set_data(hist_counts_h)
-
-        hist_counts_c, _ = np.histogram(c_weight_list, self.bin_edges_weight)
-        self._weight_stair_c.set_data(hist_counts_c)
-        plt.pause(0.001)
+        self._c_distribute_cmap.set_data(distribution)
+
+    def update_hist(self, attr, h_values, c_values):
+        """
+        update the herbivores and carnivores histograms of one attribute in the figure,
+        both counted in a single pass.
+
+        Parameters
+        ----------
+        attr: str
+            'fitness', 'age' or 'weight'
+        h_values: array_like
+            The values of the attribute of the herbivores
+        c_values: array_like
+            The values of the attribute of the carnivores
+        """
+        bin_edges = self._bin_edges[attr]
+        n_bins = len(bin_edges) - 1
+        groups = np.repeat([0, 1], [len(h_values), len(c_values)])
+        hist_counts = _fast_uhist(np.concatenate((h_values, c_values)), bin_edges, groups, 2)
+        getattr(self, f'_{attr}_stair_h').set_data(hist_counts[:n_bins])
+        getattr(self, f'_{attr}_stair_c').set_data(hist_counts[n_bins:])
 
     def save_graphics(self):
         """
@@ -381,6 +518,11 @@ class Graphics:
         if self._img_base is None:
             pass
 
+        elif self._ffproc is not None:
+            self._fig.canvas.draw()
+            self._ffproc.stdin.write(self._fig.canvas.buffer_rgba())
+            self._img_ctr += 1
+
         else:
             workdir = Path(f'./{self.img_dir}')
             if workdir.exists():
@@ -388,7 +530,8 @@ class Graphics:
             else:
                 workdir.mkdir()
             workpath = Path(f'{workdir}/{self.img_base}_{self._img_ctr:05d}.{self._img_fmt}')
-            plt.savefig(workpath)
+            pil_kwargs = _PNG_PIL_KWARGS if self._img_fmt == 'png' else None
+            self._fig.savefig(workpath, dpi=_IMG_DPI, pil_kwargs=pil_kwargs)
             self._img_ctr += 1
 
     def make_movie(self, movie_fmt=None):
@@ -407,6 +550,16 @@ class Graphics:
         if movie_fmt is None:
             movie_fmt = _DEFAULT_MOVIE_FORMAT
 
+        if self._ffproc is not None:
+            # the frames are already in ffmpeg, which only writes the mp4 movie
+            if movie_fmt != 'mp4':
+                raise ValueError('Only mp4 movies can be made from streamed frames, not '
+                                 + movie_fmt)
+            returncode = self.close()
+            if returncode != 0:
+                raise RuntimeError('ERROR: ffmpeg failed with exit status {}'.format(returncode))
+            return
+
         if movie_fmt == 'mp4':
             try:
                 # Parameters chosen according to http://trac.ffmpeg.org/wiki/Encode/H.264,
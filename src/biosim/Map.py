@@ -5,9 +5,29 @@ The Map class
 __author__ = 'Hongpeng Zhang and Sujan Devkota'
 __email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import weakref
 import numpy as np
 from biosim import Cell, Animal
 
+# The result of Map.annul_cycle: the herbivores and carnivores alive after the year, the amount
+# of each species per cell, and the fitness, age and weight arrays of each species. All but the
+# animal lists are None unless the histograms are collected.
+AnnualResult = namedtuple('AnnualResult',
+                          ['herbivores', 'carnivores',
+                           'herbivores_distribute', 'carnivores_distribute',
+                           'h_fitness', 'h_age', 'h_weight',
+                           'c_fitness', 'c_age', 'c_weight'],
+                          defaults=(None,) * 8)
+
+# The result of Map.population_stats: the amount of each species on the map and the sums of
+# their weights and ages.
+PopulationStats = namedtuple('PopulationStats',
+                             ['n_h', 'n_c', 'sum_h_weight', 'sum_c_weight',
+                              'sum_h_age', 'sum_c_age'])
+
 
 class Map:
     """
@@ -15,51 +35,72 @@ class Map:
     """
     geography_dict = {'W': 'Water', 'L': 'Lowland', 'H': 'Highland', 'D': 'Desert'}
 
-    def __init__(self, island_map):
+    def __init__(self, island_map, seed=None, n_threads=1):
         """
 
         Parameters
         ----------
         island_map: str
             Multi-line string specifying island geography
+        seed: int or numpy.random.Generator
+            Seed of the random number streams handed to the cells, unseeded if None. For a
+            Generator the cell streams are spawned from the seed the Generator was built from
+        n_threads: int
+            Amount of threads feeding the cells in parallel, the cells share nothing while
+            feeding and hunting runs in compiled kernels releasing the GIL. The thread pool is
+            started at the first feeding and shut down by close
 
         Notes
         -----
         - island_map should be a rectangle or a square, and the border should be water e.g.,
         """
         self.island_map = island_map
+        # A 2d numpy array with a letter in each position, representing the geography information
+        # for the cell in the same position, built once since the map never changes.
+        self.island_map_array = np.array([list(line) for line in island_map.split('\n')])
+        self._land_mask = self.island_map_array != 'W'
+        # flat indices of the cells of each landscape with fodder, so produce adds the fodder of
+        # each landscape without testing the landscape of every cell
+        self._L_idx = np.flatnonzero(self.island_map_array == 'L')
+        self._H_idx = np.flatnonzero(self.island_map_array == 'H')
+        if isinstance(seed, np.random.Generator):
+            self._seed_sequence = seed.bit_generator.seed_seq
+        else:
+            self._seed_sequence = np.random.SeedSequence(seed)
         self.cells_array = self.init_cells_array()
-
-    @property
-    def island_map_array(self):
-        """
-        Turn island_map into a numpy array
-
-        Returns
-        -------
-        Numpy array
-            A 2d numpy array with a letter in each position, representing the geography information
-            for the cell in the same position.
-        """
-        return np.array([list(line) for line in self.island_map.split('\n')])
+        # flat views of the cells every phase loops over, the map layout never changes
+        self._land_cells = self.cells_array[self._land_mask]
+        # the fodder of all cells in one array, each cell reads and writes its own element; the
+        # cells hold the array itself and not a view, so a deepcopy of the map keeps them linked
+        self._fodder = np.zeros(self.island_map_array.shape, dtype=np.float64)
+        for loc, cell in np.ndenumerate(self.cells_array):
+            cell._fodder, cell._fodder_idx = self._fodder, loc
+        self._land_coords = np.argwhere(self._land_mask)
+        # each land cell paired with the accessible cells around it, used by migrate
+        self._neighbor_table = [(cell, self.get_neighbors(i, j))
+                                for (i, j), cell in zip(self._land_coords, self._land_cells)]
+        self.migration_year = 0  # the current migration season
+        self.n_threads = n_threads
+        self._pool = None
 
     def init_cells_array(self):
         """
         Init the numpy array with the cell instances,
-        each cell instance has the geography information in the island_map_array.
+        each cell instance has the geography information in the island_map_array
+        and its own random number stream spawned from the map seed.
 
         Returns
         -------
         Numpy array
             A 2d numpy array with cell instances.
         """
-        cells_array = np.empty(self.island_map_array.shape, dtype=object)
-        for geo in Map.geography_dict.keys():
-            n_geo = len(cells_array[self.island_map_array == geo])
-            cells_array[self.island_map_array == geo] = [Cell.Cell(geography=geo) for _ in
-                                                         range(n_geo)]
+        island_map_array = self.island_map_array
+        seeds = np.empty(island_map_array.shape, dtype=object)
+        seeds.ravel()[:] = self._seed_sequence.spawn(seeds.size)
+        make_cell = np.frompyfunc(
+            lambda geo, seed: Cell.Cell(geography=geo, rng=np.random.default_rng(seed)), 2, 1)
 
-        return cells_array
+        return make_cell(island_map_array, seeds).astype(object)
 
     def add_fauna(self, population):
         """
@@ -105,32 +146,47 @@ class Map:
                         Carnivores_list.append(Animal.Carnivores(fauna_dict['age'],
                                                                  fauna_dict['weight']))
                         Carnivores_num += 1
-                self.cells_array[loc].animal_list += animal_list
-                self.cells_array[loc].Carnivores_list += Carnivores_list
+                self.cells_array[loc].animal_list.extend(animal_list)
+                self.cells_array[loc].Carnivores_list.extend(Carnivores_list)
 
             return animal_num, Carnivores_num
 
-    def annul_cycle(self):
+    def annul_cycle(self, *, collect_histograms=False):
         """
         Do the annual cycle on the map step by step in the right order.
 
+        Parameters
+        ----------
+        collect_histograms: bool
+            If True, also collect the distributing arrays and the fitness, age and weight
+            arrays, which are only needed on the years that are visualized.
+
         Returns
         -------
-        Tuple
-            the total amount, the distributing numpy arrays, the fitness, age, weight
-            of herbivores and carnivores after the annual cycle
+        AnnualResult
+            the herbivores and carnivores lists, and if collected the distributing numpy arrays
+            and the fitness, age, weight numpy arrays of herbivores and carnivores after the
+            annual cycle
         """
         animal_percell_year = []
         carnivore_percell_year = []
 
+        # givebirth and feed only touch one cell at a time, so they run in one pass over the
+        # cells, grow_loss_die after the migration ages, thins and kills in one pass as well
         self.produce()
-        self.givebirth()
-        self.feed()
+        self._run_cells(self._before_migration)
         self.move_permit()  # give all the animals the right to move before annul migrate start
         self.migrate()
-        self.grow_loss()
         self.reset_fodder()
-        self.die()
+        self.grow_loss_die()
+
+        extend_h, extend_c = animal_percell_year.extend, carnivore_percell_year.extend
+        for cell in self._land_cells:
+            extend_h(cell.animal_list)
+            extend_c(cell.Carnivores_list)
+
+        if not collect_histograms:
+            return AnnualResult(animal_percell_year, carnivore_percell_year)
 
         def array_colormap(cellarray):
             """
@@ -147,11 +203,13 @@ class Map:
             Tuple
                 The distributing numpy arrays of herbivores and carnivores
             """
-            Herbivores_array = np.zeros(cellarray.shape)
-            Carnivores_array = np.zeros(cellarray.shape)
-            for [i, j], cell in np.ndenumerate(cellarray):
-                Herbivores_array[i, j] = len(cell.animal_list)
-                Carnivores_array[i, j] = len(cell.Carnivores_list)
+            cells = cellarray.ravel()
+            Herbivores_array = np.fromiter(map(len, [cell.animal_list for cell in cells]),
+                                           dtype=np.int32, count=cells.size
+                                           ).reshape(cellarray.shape)
+            Carnivores_array = np.fromiter(map(len, [cell.Carnivores_list for cell in cells]),
+                                           dtype=np.int32, count=cells.size
+                                           ).reshape(cellarray.shape)
 
             return Herbivores_array, Carnivores_array
 
@@ -159,69 +217,143 @@ class Map:
 
         Herbivores_distribute, Carnivores_distribute = array_colormap(cells_array)
 
-        for cell in cells_array[self.island_map_array != 'W']:
-            animal_percell_year += cell.animal_list
-            carnivore_percell_year += cell.Carnivores_list
-
-        h_fitness_list = []
-        h_age_list = []
-        h_weight_list = []
-
-        for animal in animal_percell_year:
-            h_fitness_list.append(animal.fitness)
-            h_age_list.append(animal.age)
-            h_weight_list.append(animal.weight)
-
-        c_fitness_list = []
-        c_age_list = []
-        c_weight_list = []
+        def stashed(n, suffix):
+            """
+            Fill preallocated fitness, age and weight arrays of one species from the arrays the
+            cells stashed at the end of Cell.grow_loss_and_death. The statistics only feed the
+            histograms, so they are kept in float32 and int16, ages stay far below the int16 range.
+            """
+            fitness, age, weight = (np.empty(n, dtype=np.float32), np.empty(n, dtype=np.int16),
+                                    np.empty(n, dtype=np.float32))
+            start = 0
+            for cell in self._land_cells:
+                cell_fitness = getattr(cell, '_fitness' + suffix)
+                end = start + len(cell_fitness)
+                fitness[start:end] = cell_fitness
+                age[start:end] = getattr(cell, '_ages' + suffix)
+                weight[start:end] = getattr(cell, '_weights' + suffix)
+                start = end
+            return fitness, age, weight
+
+        h_fitness_list, h_age_list, h_weight_list = stashed(len(animal_percell_year), '_h')
+        c_fitness_list, c_age_list, c_weight_list = stashed(len(carnivore_percell_year), '_c')
+
+        return AnnualResult(animal_percell_year, carnivore_percell_year,
+                            Herbivores_distribute, Carnivores_distribute,
+                            h_fitness_list, h_age_list, h_weight_list,
+                            c_fitness_list, c_age_list, c_weight_list)
+
+    def population_stats(self):
+        """
+        Get the amount, the total weight and the total age of the herbivores and the carnivores
+        on the map, summed over the age and weight arrays of all land cells at once.
 
-        for animal in carnivore_percell_year:
-            c_fitness_list.append(animal.fitness)
-            c_age_list.append(animal.age)
-            c_weight_list.append(animal.weight)
+        Returns
+        -------
+        PopulationStats
+            n_h, n_c, sum_h_weight, sum_c_weight, sum_h_age, sum_c_age
+        """
+        land_cells = self._land_cells
+        h_ages, h_weights = Cell.Cell.animal_arrays(
+            list(chain.from_iterable(cell.animal_list for cell in land_cells)))
+        c_ages, c_weights = Cell.Cell.animal_arrays(
+            list(chain.from_iterable(cell.Carnivores_list for cell in land_cells)))
 
-        return animal_percell_year, carnivore_percell_year, \
-            Herbivores_distribute, Carnivores_distribute, \
-            h_fitness_list, h_age_list, h_weight_list, \
-            c_fitness_list, c_age_list, c_weight_list
+        return PopulationStats(h_ages.size, c_ages.size, h_weights.sum(), c_weights.sum(),
+                               h_ages.sum(), c_ages.sum())
 
     def produce(self):
         """Produce fodder on Low land and High land cells in the map."""
-        for cell in self.cells_array[(self.island_map_array == 'L')
-                                     | (self.island_map_array == 'H')]:
-            cell.produce_fodder()
+        fodder = self._fodder.ravel()
+        fodder[self._L_idx] += Cell.Cell.ParamCell['f_max_L']
+        fodder[self._H_idx] += Cell.Cell.ParamCell['f_max_H']
 
     def givebirth(self):
         """Let herbivores and carnivores in the map procreate."""
-        for cell in self.cells_array[self.island_map_array != 'W']:
+        for cell in self._land_cells:
             cell.herbivore_birth()
             cell.carnivore_birth()
 
     def feed(self):
         """Let herbivores and carnivores in the map feed themselves."""
-        for cell in self.cells_array[self.island_map_array != 'W']:
-            cell.feed_animals()
-            cell.feed_carnivores()
+        self._run_cells(self._feed_cell)
+
+    def _run_cells(self, step):
+        """
+        Run a step which only touches one cell on every land cell, in the thread pool if
+        the map has one.
+
+        Parameters
+        ----------
+        step: callable
+            Function taking the cell
+        """
+        if self.n_threads > 1:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.n_threads)
+                # shut the threads down when the map is garbage collected without close
+                self._pool_finalizer = weakref.finalize(self, self._pool.shutdown)
+            # list() to wait for all cells and raise the errors of the threads
+            list(self._pool.map(step, self._land_cells))
+        else:
+            for cell in self._land_cells:
+                step(cell)
+
+    def close(self):
+        """
+        Shut down the thread pool of the map, if it has one. The map stays usable, a later
+        feeding starts a new pool.
+        """
+        if self._pool is not None:
+            self._pool_finalizer()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self):
+        """
+        State for copy and pickle without the thread pool, the copy starts its own pool.
+        """
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state.pop('_pool_finalizer', None)
+        return state
+
+    @staticmethod
+    def _before_migration(cell):
+        """Let the animals in one cell give birth and feed themselves."""
+        cell.herbivore_birth()
+        cell.carnivore_birth()
+        cell.feed_animals()
+        cell.feed_carnivores()
+
+    @staticmethod
+    def _feed_cell(cell):
+        """Let herbivores and then carnivores in one cell feed themselves."""
+        cell.feed_animals()
+        cell.feed_carnivores()
 
     def move_permit(self):
-        """Give herbivores and carnivores in the map permission to move."""
-        for cell in self.cells_array[self.island_map_array != 'W']:
-            for animal in cell.animal_list:
-                animal.moved = False
-            for animal in cell.Carnivores_list:
-                animal.moved = False
+        """
+        Give herbivores and carnivores in the map permission to move by starting a new migration
+        season. Animals remember the season they last moved in, so no animal has to be reset.
+        """
+        self.migration_year += 1
 
     def migrate(self):
         """Let herbivores and carnivores in the map migrate to accessible places. """
-        for [i, j], cell in np.ndenumerate(self.cells_array):
-            if cell.geography != 'W':
-                neighbors = self.get_neighbors(i, j)
-                cell.animal_migration(neighbors)
+        year = self.migration_year
+        for cell, neighbors in self._neighbor_table:
+            cell.animal_migration(neighbors, year)
 
     def get_neighbors(self, i, j):
         """
         Get the accessible cells list for fauna on the cell with the location i, j in the map.
+        Only called once per land cell to build the neighbor table.
 
         Parameters
         ----------
@@ -256,17 +388,24 @@ class Map:
 
     def grow_loss(self):
         """Let herbivores and carnivores in the map loss weight."""
-        for cell in self.cells_array[self.island_map_array != 'W']:
+        for cell in self._land_cells:
             cell.grow_and_loose_weight_herbivore()
             cell.grow_and_loose_weight_carnivore()
 
     def reset_fodder(self):
         """Reset the fodder amount after herbivores and carnivores feed themselves in the map"""
-        for cell in self.cells_array[self.island_map_array != 'W']:
-            cell.fodder = 0
+        self._fodder.fill(0)
+
+    def grow_loss_die(self):
+        """
+        Let herbivores and carnivores in the map grow, loss weight and die. Each cell stashes the
+        fitness, age and weight arrays of its survivors in Cell.grow_loss_and_death.
+        """
+        for cell in self._land_cells:
+            cell.grow_loss_and_death()
 
     def die(self):
         """Let herbivores and carnivores in the map die."""
-        for cell in self.cells_array[self.island_map_array != 'W']:
+        for cell in self._land_cells:
             cell.herbivore_death()
             cell.carnivore_death()
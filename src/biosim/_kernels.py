@@ -0,0 +1,193 @@
+"""
+Numba compiled kernels for the hot loops of the annual cycle. The kernels work on numpy arrays
+of the animal properties in a cell instead of the animal objects. The kernels release the GIL,
+so cells can run them in parallel threads. The kernels calculating the fitness are compiled
+without fastmath, which assumes no inf and breaks the fitness when np.exp overflows.
+"""
+
+__author__ = 'Hongpeng Zhang and Sujan Devkota'
+__email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True, nogil=True)
+def fitness(age, weight, param_vec):
+    """
+    Calculate the fitness of one animal, 0 if its weight is <= 0. The other kernels and the
+    Animal class all calculate the fitness with this function. It is compiled without fastmath,
+    which assumes no inf, so the fitness goes to 0 when np.exp overflows.
+
+    Parameters
+    ----------
+    age: float
+    weight: float
+    param_vec: numpy array
+        phi_age, a_half, phi_weight and w_half of the species, see Animal._param_vec
+
+    Returns
+    -------
+    float
+        The fitness of the animal
+    """
+    if weight <= 0:
+        return 0.0
+    return 1 / ((1 + np.exp(param_vec[0] * (age - param_vec[1])))
+                * (1 + np.exp(-param_vec[2] * (weight - param_vec[3]))))
+
+
+@njit(cache=True, nogil=True)
+def update_fitness(ages, weights, out, param_vec):
+    """
+    Calculate the fitness of the animals of one species, 0 for animals with weight <= 0.
+
+    Parameters
+    ----------
+    ages: numpy array
+    weights: numpy array
+    out: numpy array
+        Array the fitness is written into
+    param_vec: numpy array
+        phi_age, a_half, phi_weight and w_half of the species, see Animal._param_vec
+
+    Returns
+    -------
+    Numpy array
+        out
+    """
+    for i in range(ages.shape[0]):
+        out[i] = fitness(ages[i], weights[i], param_vec)
+
+    return out
+
+
+@njit(cache=True, nogil=True)
+def hunt_step(c_fitness, c_weight, h_fitness, h_weight, F, beta, delta_phi_max, rand_buf):
+    """
+    Let all carnivores in a cell hunt the herbivores in the cell. Carnivores hunt in the given
+    order and try to kill the herbivores in the given order, a herbivore is killed with
+    probability:
+
+    0 if fitness of carnivore <= fitness of herbivore
+    (carnivore fitness - herbivore fitness) / delta_phi_max if the difference < delta_phi_max
+    1 otherwise
+
+    A carnivore stops after the herbivore which makes the eaten weight reach F, and its weight
+    increases by beta * eaten weight.
+
+    Parameters
+    ----------
+    c_fitness: numpy array
+        Fitness of the carnivores in hunting order
+    c_weight: numpy array
+        Weight of the carnivores, updated in place
+    h_fitness: numpy array
+        Fitness of the herbivores in hunted order
+    h_weight: numpy array
+        Weight of the herbivores
+    F: float
+    beta: float
+    delta_phi_max: float
+    rand_buf: numpy array
+        Uniform random numbers with shape (carnivores, herbivores)
+
+    Returns
+    -------
+    Numpy array
+        Boolean mask of the eaten herbivores
+    """
+    eaten = np.zeros(h_fitness.shape[0], dtype=np.bool_)
+    for c in range(c_fitness.shape[0]):
+        fit = c_fitness[c]
+        eaten_weight = 0.0
+        for h in range(h_fitness.shape[0]):
+            if eaten[h]:
+                continue
+            diff = fit - h_fitness[h]
+            if diff <= 0:
+                prob = 0.0
+            elif diff < delta_phi_max:
+                prob = diff / delta_phi_max
+            else:
+                prob = 1.0
+            if rand_buf[c, h] < prob:
+                eaten[h] = True
+                eaten_weight += h_weight[h]
+                if eaten_weight >= F:
+                    break
+        c_weight[c] += beta * eaten_weight
+
+    return eaten
+
+
+@njit(cache=True, nogil=True)
+def grow_loss(ages, weights, fitness_out, eta, param_vec):
+    """
+    Let the animals of one species in a cell get one year older and lose eta of their weight,
+    and calculate their new fitness in the same pass, 0 for animals with weight 0.
+
+    Parameters
+    ----------
+    ages: numpy array
+        Ages of the animals, updated in place
+    weights: numpy array
+        Weights of the animals, updated in place
+    fitness_out: numpy array
+        Array the fitness after the aging is written into
+    eta: float
+    param_vec: numpy array
+        phi_age, a_half, phi_weight and w_half of the species, see Animal._param_vec
+
+    Returns
+    -------
+    Numpy array
+        fitness_out
+    """
+    for i in range(ages.shape[0]):
+        weight = weights[i] - weights[i] * eta
+        if weight < 0:
+            weight = 0.0
+        ages[i] += 1
+        weights[i] = weight
+        fitness_out[i] = fitness(ages[i], weight, param_vec)
+
+    return fitness_out
+
+
+@njit(cache=True, nogil=True)
+def age_and_die(ages, weights, fitness_out, eta, omega, param_vec, rand_buf):
+    """
+    Do the end of year steps for the animals of one species in a cell: every animal gets one
+    year older and loses eta of its weight as in grow_loss, then dies with certainty if its
+    weight is 0 and with probability omega * (1 - fitness) otherwise.
+
+    Parameters
+    ----------
+    ages: numpy array
+        Ages of the animals, updated in place
+    weights: numpy array
+        Weights of the animals, updated in place
+    fitness_out: numpy array
+        Array the fitness after the aging is written into
+    eta: float
+    omega: float
+    param_vec: numpy array
+        phi_age, a_half, phi_weight and w_half of the species, see Animal._param_vec
+    rand_buf: numpy array
+        Uniform random numbers, one per animal
+
+    Returns
+    -------
+    Numpy array
+        Boolean mask of the died animals
+    """
+    grow_loss(ages, weights, fitness_out, eta, param_vec)
+    dies = np.empty(ages.shape[0], dtype=np.bool_)
+    for i in range(ages.shape[0]):
+        if weights[i] <= 0:
+            dies[i] = True
+        else:
+            dies[i] = rand_buf[i] < omega * (1 - fitness_out[i])
+
+    return dies
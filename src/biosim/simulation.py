@@ -5,7 +5,6 @@ BioSim class. Top level class of the simulation
 __author__ = 'Hongpeng Zhang and Sujan Devkota'
 __email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
 
-import random
 import numpy as np
 from biosim import Cell, Animal, Graphics
 from biosim import Map
@@ -20,7 +19,7 @@ class BioSim:
     def __init__(self, island_map, ini_pop, seed,
                  vis_years=1, ymax_animals=None, cmax_animals=None, hist_specs=None,
                  img_years=None, img_dir=None, img_base=None, img_fmt='png',
-                 log_file=None):
+                 log_file=None, movie_stream=False, n_threads=1):
 
         """
         Parameters
@@ -49,6 +48,11 @@ class BioSim:
             File type for figures, e.g. 'png' or 'pdf'
         log_file : str
             If given, write animal counts to this file
+        movie_stream : bool
+            If True, stream the frames straight into ffmpeg instead of writing figures,
+            make_movie then finishes the mp4 movie
+        n_threads : int
+            Amount of threads feeding the cells of the island in parallel (default: 1)
 
         Notes
         -----
@@ -82,26 +86,28 @@ class BioSim:
         - `img_dir` and `img_base` must either be both None or both strings.
         """
         # check if the map is legal
-        row_lengths = [len(line) for line in island_map.split('\n')]
-        if len(set(row_lengths)) > 1:
+        rows = island_map.split('\n')
+        ncol = len(rows[0])
+        if any(len(row) != ncol for row in rows):
             raise ValueError('The Map must be a square or a Rectangle')
-        else:
-            map_array = np.array([list(line) for line in island_map.split('\n')])
-            if any(map_array[0, :] != 'W') | any(map_array[-1, :] != 'W') | \
-                    any(map_array[:, 0] != 'W') | any(map_array[:, -1] != 'W'):
-                raise ValueError('The boundary of the map must be "H"')
-        for letter in island_map.replace('\n', 'W'):
-            if letter not in BioSim.geography_dict.keys():
-                raise ValueError(f'"{letter}"  is not a proper landscape type'
-                                 f', landscape type must be one of "W", "D", "H", "L"')
+        # view the letters as a 2d array straight from the UTF-32 bytes of the map
+        map_array = np.frombuffer(''.join(rows).encode('utf-32-le'),
+                                  dtype='<U1').reshape(len(rows), ncol)
+        if not (np.all(map_array[[0, -1], :] == 'W') and np.all(map_array[:, [0, -1]] == 'W')):
+            raise ValueError('The boundary of the map must be "H"')
+        legal = np.isin(map_array, list(BioSim.geography_dict.keys()))
+        if not legal.all():
+            letter = map_array[~legal][0]
+            raise ValueError(f'"{letter}"  is not a proper landscape type'
+                             f', landscape type must be one of "W", "D", "H", "L"')
 
         # init the sim if map is legal
         self.island_map = island_map
         self.ini_pop = ini_pop
         self.seed = seed
-        random.seed(seed)
         self._year = 0
-        self._map_instance = Map.Map(self.island_map)   # make a map instance
+        # make a map instance
+        self._map_instance = Map.Map(self.island_map, seed=seed, n_threads=n_threads)
         self._herbivores_num, self._carnivores_num = self.add_population(self.ini_pop)
         # arguments about ploting
         self.ymax_animals = ymax_animals
@@ -112,8 +118,18 @@ class BioSim:
         self.img_years = img_years
         self.vis_years = vis_years
         self.img_fmt = img_fmt
-        self._graphics = Graphics.Graphics(self.island_map, self.img_dir, self.img_base,
-                                           self.img_fmt, self.hist_specs)
+        self._movie_stream = movie_stream
+        # built on first use, so runs without graphics never create a figure
+        self._graphics = None
+
+    @property
+    def graphics(self):
+        """The Graphics instance of the simulation, created the first time it is used."""
+        if self._graphics is None:
+            self._graphics = Graphics.Graphics(self.island_map, self.img_dir, self.img_base,
+                                               self.img_fmt, self.hist_specs,
+                                               movie_stream=self._movie_stream)
+        return self._graphics
 
     def set_animal_parameters(self, species, params):
         """
@@ -170,35 +186,73 @@ class BioSim:
             Number of years to simulate
         """
         if self.vis_years == 0:
-            self.vis_years = 1
+            self._run_headless(num_years)
+            return
         if self.img_years is None:
             self.img_years = self.vis_years
         if self.img_years % self.vis_years != 0:
             raise ValueError('img_years must be multiple of vis_years')
 
         self._final_years = self._year + num_years
-        self._graphics.setup(self._final_years, self.img_years, self.cmax_animals)
+        self.graphics.setup(self._final_years, self.img_years, self.cmax_animals)
+        # the first visualized and saved years are the next multiples of vis_years and img_years,
+        # from then on the counters step forward instead of testing every year
+        next_vis = -(-self._year // self.vis_years) * self.vis_years
+        next_img = -(-self._year // self.img_years) * self.img_years
         while self._year < self._final_years:
             # Map and Cells annual cycle
-            animal_percell_year, carnivore_percell_year,\
-                Herbivores_distribute, Carnivores_distribute,\
-                h_fitness_list, h_age_list, h_weight_list,\
-                c_fitness_list, c_age_list, c_weight_list = self._map_instance.annul_cycle()
+            visualize = self._year == next_vis
+            cycle_result = self._map_instance.annul_cycle(collect_histograms=visualize)
             self._herbivores_num, self._carnivores_num = \
-                len(animal_percell_year), len(carnivore_percell_year)
-            if self._year % self.vis_years == 0:
-                self._graphics.update_year_counter(self._year)
-                self._graphics.update_fauna_amount(
-                    self._year, len(animal_percell_year), len(carnivore_percell_year))
-                self._graphics.update_herbivores_distribute(Herbivores_distribute)
-                self._graphics.update_carnivores_distribute(Carnivores_distribute)
-                self._graphics.update_fitness(self._year, h_fitness_list, c_fitness_list)
-                self._graphics.update_age(self._year, h_age_list, c_age_list)
-                self._graphics.update_weight(self._year, h_weight_list, c_weight_list)
-            if self._year % self.img_years == 0:
-                self._graphics.save_graphics()
+                len(cycle_result.herbivores), len(cycle_result.carnivores)
+            if visualize:
+                # img_years is a multiple of vis_years, so every saved year is visualized
+                save = self._year == next_img
+                self._visualize(cycle_result, save)
+                next_vis += self.vis_years
+                if save:
+                    next_img += self.img_years
             self._year += 1
 
+    def _run_headless(self, num_years):
+        """
+        Run the annual cycles without graphics, used when vis_years is 0.
+
+        Parameters
+        ----------
+        num_years : int
+            Number of years to simulate
+        """
+        self._final_years = self._year + num_years
+        annul_cycle = self._map_instance.annul_cycle
+        while self._year < self._final_years:
+            cycle_result = annul_cycle()
+            self._herbivores_num, self._carnivores_num = \
+                len(cycle_result.herbivores), len(cycle_result.carnivores)
+            self._year += 1
+
+    def _visualize(self, cycle_result, save):
+        """
+        Update the graphics with the result of the annual cycle of a visualized year, and save
+        the figure if the year is saved.
+
+        Parameters
+        ----------
+        cycle_result : AnnualResult
+            The result of Map.annul_cycle, with the histograms collected
+        save : bool
+            If the figure is saved this year
+        """
+        self.graphics.visualize(
+            self._year, self._herbivores_num, self._carnivores_num,
+            cycle_result.herbivores_distribute, cycle_result.carnivores_distribute,
+            {'fitness': cycle_result.h_fitness, 'age': cycle_result.h_age,
+             'weight': cycle_result.h_weight},
+            {'fitness': cycle_result.c_fitness, 'age': cycle_result.c_age,
+             'weight': cycle_result.c_weight})
+        if save:
+            self.graphics.save_graphics()
+
     def add_population(self, population):
         """
         Add a population to the island
@@ -234,4 +288,4 @@ class BioSim:
 
     def make_movie(self):
         """Make movie after the simulation figures of each year saved"""
-        self._graphics.make_movie()
+        self.graphics.make_movie()
@@ -5,7 +5,6 @@ BioSim class. Top level class of the simulation
 __author__ = 'Hongpeng Zhang and Sujan Devkota'
 __email__ = 'hongpeng.zhang@nmbu.no and sujan.devkota@nmbu.no'
 
-import random
 import numpy as np
 import pandas as pd
 from biosim import Cell, Animal, Graphics
@@ -83,26 +82,27 @@ class BioSim:
         - `img_dir` and `img_base` must either be both None or both strings.
         """
         # check if the map is legal
-        row_lengths = [len(line) for line in island_map.split('\n')]
-        if len(set(row_lengths)) > 1:
+        rows = island_map.split('\n')
+        ncol = len(rows[0])
+        if any(len(row) != ncol for row in rows):
             raise ValueError('The Map must be a square or a Rectangle')
-        else:
-            map_array = np.array([list(line) for line in island_map.split('\n')])
-            if any(map_array[0, :] != 'W') | any(map_array[-1, :] != 'W') | \
-                    any(map_array[:, 0] != 'W') | any(map_array[:, -1] != 'W'):
-                raise ValueError('The boundary of the map must be "H"')
-        for letter in island_map.replace('\n', 'W'):
-            if letter not in BioSim.geography_dict.keys():
-                raise ValueError(f'"{letter}"  is not a proper landscape type'
-                                 f', landscape type must be one of "W", "D", "H", "L"')
+        # view the letters as a 2d array straight from the UTF-32 bytes of the map
+        map_array = np.frombuffer(''.join(rows).encode('utf-32-le'),
+                                  dtype='<U1').reshape(len(rows), ncol)
+        if not (np.all(map_array[[0, -1], :] == 'W') and np.all(map_array[:, [0, -1]] == 'W')):
+            raise ValueError('The boundary of the map must be "H"')
+        legal = np.isin(map_array, list(BioSim.geography_dict.keys()))
+        if not legal.all():
+            letter = map_array[~legal][0]
+            raise ValueError(f'"{letter}"  is not a proper landscape type'
+                             f', landscape type must be one of "W", "D", "H", "L"')
 
         # init the sim if map is legal
         self.island_map = island_map
         self.ini_pop = ini_pop
         self.seed = seed
-        random.seed(seed)
         self._year = 0
-        self._map_instance = Map.Map(self.island_map)   # make a map instance
+        self._map_instance = Map.Map(self.island_map, seed=seed)   # make a map instance
         self._herbivores_num, self._carnivores_num = self.add_population(self.ini_pop)
 
         self._herbivores_agelist = []
@@ -214,14 +214,17 @@ class BioSim:
             animal_percell_year, carnivore_percell_year,\
                 Herbivores_distribute, Carnivores_distribute,\
                 h_fitness_list, h_age_list, h_weight_list,\
-                c_fitness_list, c_age_list, c_weight_list = self._map_instance.annul_cycle()
+                c_fitness_list, c_age_list, c_weight_list = self._map_instance.annul_cycle(
+                    collect_histograms=True)
             self._herbivores_num, self._carnivores_num = \
                 len(animal_percell_year), len(carnivore_percell_year)
 
-            self._herbivores_agelist = h_age_list
-            self._herbivores_weightlist = h_weight_list
-            self._carnivores_agelist = c_age_list
-            self._carnivores_weightlist = c_weight_list
+            # the yearly age and weight records keep the full precision of the animals, the
+            # float32/int16 arrays of the annual cycle are only meant for the histograms
+            h_ages, self._herbivores_weightlist = Cell.Cell.animal_arrays(animal_percell_year)
+            c_ages, self._carnivores_weightlist = Cell.Cell.animal_arrays(carnivore_percell_year)
+            self._herbivores_agelist = h_ages.astype(int)
+            self._carnivores_agelist = c_ages.astype(int)
 
             self.simulate_log(len(animal_percell_year), len(carnivore_percell_year))
 
@@ -0,0 +1,22 @@
+"""
+Shared pytest configuration for the biosim tests
+"""
+import numpy as np
+
+
+def pytest_configure(config):
+    """
+    Call each compiled kernel once with the argument types the simulation uses, so the kernels
+    are compiled, or loaded from the numba cache, before the first test instead of inside it.
+    """
+    from biosim import _kernels, Animal
+
+    values = np.ones(1)
+    param_vec = Animal.Herbivores._param_vec
+    _kernels.fitness(1.0, 1.0, param_vec)
+    _kernels.update_fitness(values, values.copy(), np.empty(1), param_vec)
+    _kernels.hunt_step(values, values.copy(), values.copy(), values.copy(), 1.0, 1.0, 1.0,
+                       np.zeros((1, 1)))
+    _kernels.grow_loss(values.copy(), values.copy(), np.empty(1), 0.05, param_vec)
+    _kernels.age_and_die(values.copy(), values.copy(), np.empty(1), 0.05, 0.4, param_vec,
+                         np.zeros(1))
@@ -1,40 +1,47 @@
 from biosim.Animal import Herbivores, Carnivores
+import numpy as np
 import pytest
 
 
-@pytest.mark.parametrize("age, weight",
-                         [[1, 40],
-                          [2, 50],
-                          [20, 50]])
-def test_fitness_after_weight_loss(age, weight):
+@pytest.fixture
+def rng():
+    """A seeded random number generator, so the probabilistic tests take the same branch on every
+    run"""
+    return np.random.default_rng(12345)
+
+
+@pytest.fixture(params=[(1, 40), (2, 50), (20, 50)], ids=['young', 'adult', 'old'])
+def sample_animals(request):
+    """
+    A herbivore and a carnivore of the same age and weight, built anew for each test since the
+    tests change them
+    """
+    return Herbivores(*request.param), Carnivores(*request.param)
+
+
+def test_fitness_after_weight_loss(sample_animals):
     """
     test the fitness after change in weight for both herbivore and carnivore
     """
-    herbivore_animal = Herbivores(age, weight)
+    herbivore_animal, carnivore_animal = sample_animals
     before_fitness_h = herbivore_animal.fitness
     herbivore_animal.weight_loss_per_year()
     assert before_fitness_h > herbivore_animal.fitness
 
-    carnivore_animal = Carnivores(age, weight)
     before_fitness_c = carnivore_animal.fitness
     carnivore_animal.weight_loss_per_year()
     assert before_fitness_c > carnivore_animal.fitness
 
 
-@pytest.mark.parametrize("age, weight",
-                         [[1, 40],
-                          [2, 50],
-                          [20, 50]])
-def test_fitness_after_age_increase(age, weight):
+def test_fitness_after_age_increase(sample_animals):
     """
     test the fitness after change in age for herbivore and carnivore
     """
-    animal = Herbivores(age, weight)
+    animal, carnivore_animal = sample_animals
     before_fitness = animal.fitness
     animal.growth_per_year()
     assert before_fitness > animal.fitness
 
-    carnivore_animal = Carnivores(age, weight)
     before_fitness_c = carnivore_animal.fitness
     carnivore_animal.growth_per_year()
     assert before_fitness_c > carnivore_animal.fitness
@@ -44,34 +51,67 @@ def test_fitness_after_age_increase(age, weight):
                          [[1, 40, 150],
                           [2, 50, 200],
                           [20, 50, 80]])
-def test_fitness_after_procreate(age, weight, num_species):
+def test_fitness_after_procreate(age, weight, num_species, rng):
     """
     test the fitness after animal has given birth for both herbivore and carnivore
     """
     animal_h = Herbivores(age, weight)
     before_fitness_h = animal_h.fitness
 
-    if animal_h.procreate(num_species)[0]:
+    if animal_h.procreate(num_species, rng)[0]:
         after_fitness_h = animal_h.fitness
         assert before_fitness_h > after_fitness_h
 
     animal_c = Carnivores(age, weight)
     before_fitness_c = animal_c.fitness
 
-    if animal_c.procreate(num_species)[0]:
+    if animal_c.procreate(num_species, rng)[0]:
         after_fitness_c = animal_c.fitness
         assert before_fitness_c > after_fitness_c
 
 
-@pytest.mark.parametrize("age, weight",
-                         [[1, 40],
-                          [2, 50],
-                          [20, 50]])
-def test_fitness_after_eat_herbivore(age, weight):
+@pytest.mark.parametrize("species", [Herbivores, Carnivores])
+def test_fitness_vector(species):
+    """
+    test the vectorized fitness gives the same fitness as the fitness of each animal
+    """
+    animals = [species(age, weight) for age, weight in [[1, 40], [2, 50], [20, 50], [5, 0]]]
+    ages = np.array([animal.age for animal in animals], dtype=float)
+    weights = np.array([animal.weight for animal in animals], dtype=float)
+    assert list(species.fitness_vector(ages, weights)) == [animal.fitness for animal in animals]
+
+
+def test_fitness_cache_after_parameter_change():
+    """
+    test the cached fitness is recalculated after the fitness parameters change
+    """
+    animal = Herbivores(5, 20)
+    before_fitness = animal.fitness
+    Herbivores.set_params({'w_half': 30.0})
+    after_fitness = animal.fitness
+    Herbivores.set_params({'w_half': 10.0})
+    assert before_fitness > after_fitness
+    assert animal.fitness == before_fitness
+
+
+def test_param_vec_after_parameter_change():
+    """
+    test the fitness parameters handed to the kernels follow the parameter changes
+    """
+    Herbivores.set_params({'w_half': 30.0})
+    changed_vec = Herbivores._param_vec.copy()
+    Herbivores.set_params({'w_half': 10.0})
+    assert changed_vec[3] == 30.0
+    assert list(Herbivores._param_vec) == pytest.approx([0.6, 40.0, 0.1, 10.0])
+    assert not Herbivores._param_vec.flags.writeable
+    assert Herbivores._param_vec.dtype == np.float64
+
+
+def test_fitness_after_eat_herbivore(sample_animals):
     """
     test the fitness after animal eats
     """
-    animal_h = Herbivores(age, weight)
+    animal_h = sample_animals[0]
     before_fitness_h = animal_h.fitness
     animal_h.eat()
     assert before_fitness_h < animal_h.fitness
@@ -81,28 +121,24 @@ def test_fitness_after_eat_herbivore(age, weight):
                          [[1, 50, 150],
                           [1, 24, 200],
                           [20, 20, 80]])
-def test_procreate(age, weight, num_species):
+def test_procreate(age, weight, num_species, rng):
     """
     Test that there is no birth if the age is less than 1 and the weight of the animal is less than
     (w_birth + sigma_birth)* zeta
 
     """
     animal_h = Herbivores(age, weight)
-    assert not animal_h.procreate(num_species)[0]
+    assert not animal_h.procreate(num_species, rng)[0]
 
     animal_c = Carnivores(age, weight)
-    assert not animal_c.procreate(num_species)[0]
+    assert not animal_c.procreate(num_species, rng)[0]
 
 
-@pytest.mark.parametrize("age, weight",
-                         [[1, 40],
-                          [2, 50],
-                          [20, 50]])
-def test_growup1year(age, weight):
+def test_growup1year(sample_animals):
     """
     test if animals are aging every year or not
     """
-    animal = Herbivores(age, weight)
+    animal = sample_animals[0]
     before_age = animal.age
     animal.growth_per_year()
     assert animal.age == before_age + 1
@@ -112,7 +148,7 @@ def test_growup1year(age, weight):
                          [[1, 30, 150],
                           [2, 50, 200],
                           [20, 50, 80]])
-def test_weightloss1year(age, weight, num_species):
+def test_weightloss1year(age, weight, num_species, rng):
     """
     test if animals are loosing weight each year and animals are loosing weight after giving birth
     """
@@ -121,47 +157,62 @@ def test_weightloss1year(age, weight, num_species):
     animal.weight_loss_per_year()
     assert before_weight > animal.weight
 
-    if animal.procreate(num_species)[0]:
+    if animal.procreate(num_species, rng)[0]:
         after_weight = animal.weight
         assert before_weight > after_weight
 
 
-@pytest.mark.parametrize("age, weight",
-                         [[1, 40],
-                          [2, 50],
-                          [20, 50]])
-def test_eat(age, weight):
+def test_eat(sample_animals):
     """
     test if the animals are loosing weight after eating
 
     """
-    animal = Herbivores(age, weight)
+    animal = sample_animals[0]
     before_weight = animal.weight
     animal.eat()
     assert animal.weight > before_weight
 
 
+@pytest.mark.parametrize("num_herbivores, F, num_eaten",
+                         [[10, 50.0, 3],
+                          [100, 50.0, 3],
+                          [100, 1500.0, 75],
+                          [100, 5000.0, 100]])
+def test_carnivore_eat_stops_at_F(num_herbivores, F, num_eaten, rng):
+    """
+    test the carnivore stops eating after the herbivore which makes the eaten weight reach F
+    """
+    carnivore = Carnivores(5, 50)
+    herbivores = [Herbivores(50, 20) for _ in range(num_herbivores)]
+    default_params = dict(Carnivores.parameter)
+    Carnivores.set_params({'F': F, 'DeltaPhiMax': 1e-9})
+    eaten = carnivore.eat(herbivores, rng)
+    Carnivores.set_params(default_params)
+    assert eaten == herbivores[:num_eaten]
+    assert carnivore.weight == pytest.approx(50 + default_params['beta'] * 20 * num_eaten)
+
+
 @pytest.mark.parametrize("age, weight",
                          [[1, 0],
                           [2, 0],
                           [20, 0]])
-def test_die(age, weight):
+def test_die(age, weight, rng):
     """
   Test if the animals die with certainty if weight is 0 and with probability omega * ( 1 - fitness)
     """
 
     animal_h = Herbivores(age, weight)
-    assert animal_h.die() is True
+    assert animal_h.die(rng) is True
 
     animal_c = Carnivores(age, weight)
-    assert animal_c.die() is True
+    assert animal_c.die(rng) is True
 
 
 @pytest.mark.parametrize("age, weight",
                          [[1, 2],
                           [2, 5],
                           [1, 1]])
-def test_die_probability(age, weight):
+def test_die_probability(age, weight, rng):
     """
     Testing the probability of animal to die by setting omega = 0 so, probability to die is 0 as
     probability is omega * (1- fitness) and setting omega = 10 so probability is high and animal
@@ -178,10 +229,10 @@ def test_die_probability(age, weight):
     # setting omega = 0, so, probability to die is 0 so should return False
     animal_h1 = Herbivores(age, weight)
     animal_h1.set_params({'omega': 0})
-    assert animal_h1.die() is False
+    assert animal_h1.die(rng) is False
 
     # setting omega = 10 and testing for low age and weight so probability is close to 1, should
     # return True
     animal_h2 = Herbivores(age, weight)
     animal_h2.set_params({'omega': 10})
-    assert animal_h2.die() is True
+    assert animal_h2.die(rng) is True
@@ -1,12 +1,21 @@
 from biosim.simulation import BioSim
+from biosim.Cell import Cell
+import copy
+import pytest
 
 
-def test_produce_fodder():
-    geogr = "WWW\nWLW\nWWW"
+@pytest.fixture(scope="module")
+def base_sim():
+    """Build the 3x3 island once, every test works on its own deep copy of it."""
+    return BioSim("WWW\nWLW\nWWW", [], None)
+
+
+def test_produce_fodder(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Herbivore", "age": 10, "weight": 10}]}]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
     previous_fodder = test._map_instance.cells_array[loc].fodder
     test._map_instance.cells_array[loc].produce_fodder()
@@ -15,12 +24,24 @@ def test_produce_fodder():
     assert previous_fodder < afterwards_fodder
 
 
-def test_herbivore_birth():
-    geogr = "WWW\nWLW\nWWW"
+def test_fodder_double_precision(base_sim):
+    """Test the fodder is a python float and keeps the precision of large or non-integer
+    amounts, also when it lives in the fodder array of the map."""
+    cells = [Cell('L', fodder=1e8 + 0.5), copy.deepcopy(base_sim)._map_instance.cells_array[1, 1]]
+    for cell in cells:
+        cell.fodder = 1e8 + 0.5
+        cell.fodder -= 0.25
+
+        assert type(cell.fodder) is float
+        assert cell.fodder == 1e8 + 0.25
+
+
+def test_herbivore_birth(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Herbivore", "age": 10, "weight": 200}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
     before_num_animals = len(test._map_instance.cells_array[loc].animal_list)
     test._map_instance.cells_array[loc].herbivore_birth()
@@ -29,12 +50,12 @@ def test_herbivore_birth():
     assert before_num_animals < after_num_animals
 
 
-def test_carnivore_birth():
-    geogr = "WWW\nWLW\nWWW"
+def test_carnivore_birth(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Carnivore", "age": 10, "weight": 200}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
     before_num_animals = len(test._map_instance.cells_array[loc].Carnivores_list)
     test._map_instance.cells_array[loc].carnivore_birth()
@@ -43,56 +64,44 @@ def test_carnivore_birth():
     assert before_num_animals < after_num_animals
 
 
-def test_grow_and_loose_weight_herbivore():
-    geogr = "WWW\nWLW\nWWW"
+def test_grow_and_loose_weight_herbivore(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Herbivore", "age": 10, "weight": 200}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
-    before_weight = []
+    cell = test._map_instance.cells_array[loc]
+    before_weight = [animal.weight for animal in cell.animal_list]
+    cell.grow_and_loose_weight_herbivore()
+    after_weight = [animal.weight for animal in cell.animal_list]
 
-    for animal in test._map_instance.cells_array[loc].animal_list:
-        before_weight += [(animal.weight for animal in test._map_instance.cells_array[loc].
-                          animal_list)]
+    assert len(before_weight) == len(after_weight) == 20
+    assert sum(before_weight) > sum(after_weight)
 
-    test._map_instance.cells_array[loc].grow_and_loose_weight_herbivore()
-    after_weight = []
-    for animal in test._map_instance.cells_array[loc].animal_list:
-        after_weight += [(animal.weight for animal in test._map_instance.cells_array[loc].
-                         animal_list)]
 
-    assert before_weight != after_weight
-
-
-def test_grow_and_loose_weight_carnivore():
-    geogr = "WWW\nWLW\nWWW"
+def test_grow_and_loose_weight_carnivore(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Carnivore", "age": 10, "weight": 200}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
-    before_weight = []
-
-    for animal in test._map_instance.cells_array[loc].Carnivores_list:
-        before_weight += [animal.weight for animal in test._map_instance.cells_array[loc].
-                          Carnivores_list]
-
-    test._map_instance.cells_array[loc].grow_and_loose_weight_carnivore()
-    after_weight = []
-    for animal in test._map_instance.cells_array[loc].Carnivores_list:
-        after_weight += [animal.weight for animal in test._map_instance.cells_array[loc].
-                         Carnivores_list]
+    cell = test._map_instance.cells_array[loc]
+    before_weight = [animal.weight for animal in cell.Carnivores_list]
+    cell.grow_and_loose_weight_carnivore()
+    after_weight = [animal.weight for animal in cell.Carnivores_list]
 
-    assert (sum(before_weight) > sum(after_weight))
+    assert len(before_weight) == len(after_weight) == 20
+    assert sum(before_weight) > sum(after_weight)
 
 
-def test_carnivore_death():
-    geogr = "WWW\nWLW\nWWW"
+def test_carnivore_death(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Carnivore", "age": 2, "weight": 5}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
     before_num_animals = len(test._map_instance.cells_array[loc].Carnivores_list)
     test._map_instance.cells_array[loc].carnivore_death()
@@ -101,12 +110,12 @@ def test_carnivore_death():
     assert before_num_animals > after_num_animals
 
 
-def test_herbivore_death():
-    geogr = "WWW\nWLW\nWWW"
+def test_herbivore_death(base_sim):
     ini_pop = [
         {"loc": (2, 2),
          "pop": [{"species": "Herbivore", "age": 2, "weight": 10}]} for _ in range(20)]
-    test = BioSim(geogr, ini_pop, None)
+    test = copy.deepcopy(base_sim)
+    test.add_population(ini_pop)
     loc = (1, 1)
     before_num_animals = len(test._map_instance.cells_array[loc].animal_list)
     test._map_instance.cells_array[loc].herbivore_death()
@@ -0,0 +1,129 @@
+"""
+Test module for Graphics
+"""
+from biosim.Graphics import Graphics, _fast_uhist
+from biosim import Graphics as graphics_module
+import io
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('width, bin_max',
+                         [(0.05, 1), (2, 60), (0.5, 1), (0.3, 1), (0.1, 1), (7, 60)])
+def test_fast_uhist_matches_histogram(width, bin_max):
+    """Test that _fast_uhist counts like np.histogram on the bin edges of Graphics, out of range
+    values dropped and the last edge included, also when bin_max is not a multiple of width."""
+    bin_edges = np.arange(0, bin_max + width / 2, width)
+    values = np.concatenate((np.random.uniform(-1, bin_max * 1.5, 1000), [0, bin_edges[-1]]))
+    hist_counts, _ = np.histogram(values, bin_edges)
+
+    assert np.array_equal(_fast_uhist(values, bin_edges), hist_counts)
+
+
+@pytest.mark.parametrize('width, bin_max', [(0.05, 1), (0.1, 1), (0.3, 1), (2, 60)])
+def test_fast_uhist_edges(width, bin_max):
+    """Test that values on the interior edges, and just next to them, land in the bins
+    np.histogram puts them in, although the edges are not exact in floating point."""
+    bin_edges = np.arange(0, bin_max + width / 2, width)
+    values = np.concatenate((bin_edges, np.nextafter(bin_edges, -np.inf),
+                             np.nextafter(bin_edges, np.inf), np.arange(1, 20) * width,
+                             [bin_max]))
+    hist_counts, _ = np.histogram(values, bin_edges)
+
+    assert np.array_equal(_fast_uhist(values, bin_edges), hist_counts)
+
+
+def test_fast_uhist_empty():
+    """Test that _fast_uhist gives empty bins for no values"""
+    assert np.array_equal(_fast_uhist([], np.arange(0, 2.25, 0.5)), np.zeros(4))
+
+
+def test_fast_uhist_groups():
+    """Test that the grouped _fast_uhist gives the histograms of each group one after another"""
+    bin_edges = np.arange(0, 60.25, 2)
+    h_values = np.random.uniform(0, 60, 500)
+    c_values = np.random.uniform(0, 80, 300)
+    groups = np.repeat([0, 1], [len(h_values), len(c_values)])
+    hist_counts = _fast_uhist(np.concatenate((h_values, c_values)), bin_edges, groups, 2)
+
+    assert np.array_equal(hist_counts[:30], _fast_uhist(h_values, bin_edges))
+    assert np.array_equal(hist_counts[30:], _fast_uhist(c_values, bin_edges))
+
+
+def test_map_rgb():
+    """Test that each cell of map_rgb has the uint8 colour of its landscape letter"""
+    island_map = 'WWWW\nWLHW\nWDLW\nWWWW'
+    map_rgb = Graphics(island_map).map_rgb
+
+    assert map_rgb.dtype == np.uint8
+    for row, line in zip(map_rgb, island_map.splitlines()):
+        for rgb, letter in zip(row, line):
+            assert list(rgb) == [round(value * 255) for value in Graphics.rgb_value[letter]]
+
+
+def test_distribution_color_limits():
+    """Test that both distribution maps keep the cmax_animals color limits while updated"""
+    graphics = Graphics('WWWW\nWLHW\nWDLW\nWWWW')
+    graphics.setup(final_years=2, img_years=1,
+                   cmax_animals={'Herbivore': 150, 'Carnivore': 40})
+    distribution = np.array([[0, 0, 0, 0], [0, 7, 3, 0], [0, 0, 12, 0], [0, 0, 0, 0]])
+    graphics.update_herbivores_distribute(distribution)
+    graphics.update_carnivores_distribute(distribution)
+    plt.close(graphics._fig)
+
+    assert graphics._h_distribute_cmap.get_clim() == (0, 150)
+    assert graphics._c_distribute_cmap.get_clim() == (0, 40)
+
+
+class FakeFfmpeg:
+    """Stand-in for the ffmpeg process, keeping the frames written to its stdin"""
+    instances = []
+
+    def __init__(self, args, **kwargs):
+        self.args = args
+        self.frames = []
+        self.stdin = io.BytesIO()
+        self.stdin.write = lambda frame: self.frames.append(bytes(frame))
+        self.waited = False
+        FakeFfmpeg.instances.append(self)
+
+    def wait(self):
+        self.waited = True
+        return 0
+
+
+@pytest.fixture
+def streaming_graphics(monkeypatch, tmp_path):
+    """Graphics streaming the frames into a fake ffmpeg process"""
+    FakeFfmpeg.instances = []
+    monkeypatch.setattr(graphics_module.subprocess, 'Popen', FakeFfmpeg)
+    graphics = Graphics('WWWW\nWLHW\nWDLW\nWWWW', img_dir=str(tmp_path), img_base='movie',
+                        movie_stream=True)
+    graphics.setup(final_years=2, img_years=1)
+    yield graphics
+    graphics.close()
+    plt.close(graphics._fig)
+
+
+def test_movie_stream(streaming_graphics):
+    """Test that the frames are written to ffmpeg and make_movie closes the pipe"""
+    streaming_graphics.save_graphics()
+    streaming_graphics.save_graphics()
+    ffproc, = FakeFfmpeg.instances
+    streaming_graphics.make_movie()
+
+    assert len(ffproc.frames) == 2
+    assert ffproc.stdin.closed and ffproc.waited
+    assert ffproc.args[-1].endswith('.mp4')
+
+
+def test_movie_stream_format(streaming_graphics):
+    """Test that streamed frames only make mp4 movies, and the pipe stays open after the error"""
+    with pytest.raises(ValueError):
+        streaming_graphics.make_movie('gif')
+    ffproc, = FakeFfmpeg.instances
+
+    assert not ffproc.stdin.closed
+    streaming_graphics.close()
+    assert ffproc.stdin.closed and ffproc.waited
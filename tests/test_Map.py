@@ -1,8 +1,10 @@
 """
 Test module for Map
 """
+import copy
 from biosim.Map import Map
-from biosim import Cell
+from biosim import Cell, Animal
+import numpy as np
 import pytest
 
 
@@ -48,91 +50,75 @@ class TestMapRes:
         population = ini_herbs + ini_carns
         self.plain_map.add_fauna(population)
 
+    def test_population_stats(self, test_ini_population):
+        """Test population_stats sums the animals added by the population fixture"""
+        stats = self.plain_map.population_stats()
+
+        assert stats == (50, 20, 50 * 20, 20 * 20, 50 * 5, 20 * 5)
+
     def test_produce(self, test_ini_population):
         """Test produce method"""
         num_H_land = len(self.plain_map.island_map_array[self.plain_map.island_map_array == 'H'])
         num_L_land = len(self.plain_map.island_map_array[self.plain_map.island_map_array == 'L'])
         fodder_gain = Cell.Cell.ParamCell['f_max_L'] * num_L_land + \
             Cell.Cell.ParamCell['f_max_H'] * num_H_land
-        fodder_last_year = 0
-        for cell in self.plain_map.cells_array[(self.plain_map.island_map_array == 'L')
-                                               | (self.plain_map.island_map_array == 'H')]:
-            fodder_last_year += cell.fodder
+        fodder_last_year = self.plain_map._fodder.sum()
         self.plain_map.produce()
-        fodder_next_year = 0
-        for cell in self.plain_map.cells_array[(self.plain_map.island_map_array == 'L')
-                                               | (self.plain_map.island_map_array == 'H')]:
-            fodder_next_year += cell.fodder
+        fodder_next_year = self.plain_map._fodder.sum()
 
         assert (fodder_last_year + fodder_gain) == fodder_next_year
 
     def test_givebirth(self, test_ini_population):
         """Test givebirth method"""
-        animal_num_before = 0
-        carnivore_num_before = 0
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            animal_num_before += len(cell.animal_list)
-            carnivore_num_before += len(cell.Carnivores_list)
+        before = self.plain_map.population_stats()
         self.plain_map.givebirth()
-        animal_num_after = 0
-        carnivore_num_after = 0
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            animal_num_after += len(cell.animal_list)
-            carnivore_num_after += len(cell.Carnivores_list)
+        after = self.plain_map.population_stats()
 
-        assert (animal_num_before <= animal_num_after) \
-               & (carnivore_num_before <= carnivore_num_after)
+        assert (before.n_h <= after.n_h) & (before.n_c <= after.n_c)
 
     def test_feed(self, test_ini_population):
         """Test feed method"""
-        carnivore_weight_before = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            carnivore_weight_before += [animal.weight for animal in cell.Carnivores_list]
+        before = self.plain_map.population_stats()
         self.plain_map.feed()
-        carnivore_weight_after = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            carnivore_weight_after += [animal.weight for animal in cell.Carnivores_list]
+        after = self.plain_map.population_stats()
 
-        assert (sum(carnivore_weight_after) > sum(carnivore_weight_before))
+        assert after.sum_c_weight > before.sum_c_weight
 
     def test_move_permit(self, test_ini_population):
         """Test move_permit method"""
         self.plain_map.move_permit()
-        false_list_h = []
-        false_list_c = []
+        self.plain_map.migrate()
+        self.plain_map.move_permit()
+        moved_list_h = []
+        moved_list_c = []
         for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            false_list_h += [animal.moved for animal in cell.animal_list]
-            false_list_c += [animal.moved for animal in cell.Carnivores_list]
+            moved_list_h += [animal.moved_year == self.plain_map.migration_year
+                             for animal in cell.animal_list]
+            moved_list_c += [animal.moved_year == self.plain_map.migration_year
+                             for animal in cell.Carnivores_list]
 
-        assert (~all(false_list_h)) & (~all(false_list_c))
+        assert not any(moved_list_h) and not any(moved_list_c)
 
     def test_grow_loss(self, test_ini_population):
         """Test the grow_loss method"""
-        h_age_before = []
-        c_age_before = []
-        h_weight_before = []
-        c_weight_before = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_age_before += [animal.age for animal in cell.animal_list]
-            c_age_before += [animal.age for animal in cell.Carnivores_list]
-            h_weight_before += [animal.weight for animal in cell.animal_list]
-            c_weight_before += [animal.weight for animal in cell.Carnivores_list]
-
+        before = self.plain_map.population_stats()
         self.plain_map.grow_loss()
+        after = self.plain_map.population_stats()
 
-        h_age_after = []
-        c_age_after = []
-        h_weight_after = []
-        c_weight_after = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_age_after += [animal.age for animal in cell.animal_list]
-            c_age_after += [animal.age for animal in cell.Carnivores_list]
-            h_weight_after += [animal.weight for animal in cell.animal_list]
-            c_weight_after += [animal.weight for animal in cell.Carnivores_list]
+        assert (before.sum_h_age <= after.sum_h_age) & (before.sum_c_age <= after.sum_c_age) \
+               & (before.sum_h_weight >= after.sum_h_weight) \
+               & (before.sum_c_weight >= after.sum_c_weight)
+
+    def test_grow_loss_die(self, test_ini_population):
+        """Test grow_loss_die ages the survivors and stashes their arrays on the cells"""
+        self.plain_map.grow_loss_die()
+        after = self.plain_map.population_stats()
 
-        assert (sum(h_age_before) <= sum(h_age_after)) & (sum(c_age_before) <= sum(c_age_after)) \
-               & (sum(h_weight_before) >= sum(h_weight_after)) \
-               & (sum(c_weight_before) >= sum(c_weight_after))
+        assert (after.n_h <= 50) & (after.n_c <= 20)
+        assert after.sum_h_age == 6 * after.n_h
+        cell = self.plain_map.cells_array[1, 1]
+        assert len(cell._ages_h) == len(cell.animal_list)
+        assert len(cell._fitness_c) == len(cell.Carnivores_list)
 
     def test_reset_fodder(self):
         """Test reset_fodder method"""
@@ -143,36 +129,104 @@ class TestMapRes:
 
         assert len(non_zero_cell) == 0
 
+    def test_cell_rng_seeded(self):
+        """Test that each cell gets its own stream, reproducible from the map seed"""
+        draws = [[cell.rng.random() for cell in Map(self.island_map, seed=1).cells_array.flat]
+                 for _ in range(2)]
+
+        assert draws[0] == draws[1]
+        assert len(set(draws[0])) == len(draws[0])
+
+    def test_generator_seed(self):
+        """Test that a Generator seeds the cells of the map like its integer seed"""
+        island = Map(self.island_map, seed=np.random.default_rng(1))
+        draws = [cell.rng.random() for cell in island.cells_array.flat]
+
+        seeded = Map(self.island_map, seed=1)
+        assert draws == [cell.rng.random() for cell in seeded.cells_array.flat]
+
+    def test_feed_threads(self):
+        """Test that feeding the cells in threads gives the same result as feeding them in turn"""
+        population = [{'loc': loc,
+                       'pop': [{'species': species, 'age': 5, 'weight': 20}
+                               for species in ['Herbivore'] * 50 + ['Carnivore'] * 20]}
+                      for loc in [(2, 2), (2, 3), (3, 2), (3, 3)]]
+        weights = []
+        for n_threads in (1, 4):
+            with Map(self.island_map, seed=3, n_threads=n_threads) as island:
+                island.add_fauna(population)
+                island.produce()
+                island.feed()
+            weights.append([[animal.weight for animal in cell.animal_list + cell.Carnivores_list]
+                            for cell in island.cells_array.flat])
+
+        assert weights[0] == weights[1]
+
+    def test_close_threads(self):
+        """Test that close shuts the thread pool down and that a threaded map can be copied"""
+        with Map(self.island_map, seed=3, n_threads=2) as island:
+            island.feed()
+            pool = island._pool
+            copied = copy.deepcopy(island)
+            assert copied._pool is None
+            copied.feed()
+            copied.close()
+        assert island._pool is None
+        with pytest.raises(RuntimeError):
+            pool.submit(print)
+
     def test_die(self):
         """Test die method"""
-        h_die_before = []
-        c_die_before = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_die_before += cell.animal_list
-            c_die_before += cell.Carnivores_list
+        before = self.plain_map.population_stats()
+        self.plain_map.die()
+        after = self.plain_map.population_stats()
+
+        assert (before.n_h >= after.n_h) & (before.n_c >= after.n_c)
+
+    @pytest.fixture()
+    def no_random_death(self):
+        """Set omega = 0 for the herbivores, so only the animals without weight die, and restore
+        the class level parameters after the test even if it fails"""
+        default_params = dict(Animal.Herbivores.parameter)
+        Animal.Herbivores.set_params({'omega': 0})
+        yield
+        Animal.Herbivores.set_params(default_params)
+
+    @pytest.mark.usefixtures('no_random_death')
+    def test_die_keeps_survivors(self):
+        """Test die keeps each cell's survivors in place, omega = 0 so only the animals without
+        weight die"""
+        population = [{'loc': loc,
+                       'pop': [{'species': 'Herbivore', 'age': 5, 'weight': weight}
+                               for weight in [20, 0, 20, 0, 20]]}
+                      for loc in [(2, 2), (2, 3), (3, 2)]]
+        self.plain_map.add_fauna(population)
         self.plain_map.die()
-        h_die_after = []
-        c_die_after = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_die_after += cell.animal_list
-            c_die_after += cell.Carnivores_list
 
-        assert (h_die_before >= h_die_after) & (c_die_before >= c_die_after)
+        for loc in [(1, 1), (1, 2), (2, 1)]:
+            assert [animal.weight for animal in self.plain_map.cells_array[loc].animal_list] \
+                == [20, 20, 20]
 
     def test_annul_cycle(self, test_ini_population):
         """Test annul_cycle method"""
-        h_cycle_before = []
-        c_cycle_before = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_cycle_before += cell.animal_list
-            c_cycle_before += cell.Carnivores_list
-
+        before = self.plain_map.population_stats()
         self.plain_map.annul_cycle()
-
-        h_cycle_after = []
-        c_cycle_after = []
-        for cell in self.plain_map.cells_array[self.plain_map.island_map_array != 'W']:
-            h_cycle_after += cell.animal_list
-            c_cycle_after += cell.Carnivores_list
-
-        assert (h_cycle_before != h_cycle_after) & (c_cycle_before != c_cycle_after)
+        after = self.plain_map.population_stats()
+
+        # the surviving animals lose weight and get older, so the sums change even if the
+        # same animals are still alive
+        assert (before.sum_h_weight != after.sum_h_weight) \
+               & (before.sum_c_weight != after.sum_c_weight)
+
+    @pytest.mark.parametrize('collect_histograms', [True, False])
+    def test_annul_cycle_collect_histograms(self, test_ini_population, collect_histograms):
+        """Test the annual result only carries the histogram data when it is collected"""
+        result = self.plain_map.annul_cycle(collect_histograms=collect_histograms)
+
+        if collect_histograms:
+            assert result.herbivores_distribute.sum() == len(result.herbivores)
+            assert len(result.c_weight) == len(result.carnivores)
+            assert (result.h_age.dtype, result.h_weight.dtype) == (np.int16, np.float32)
+        else:
+            assert result.herbivores_distribute is None
+            assert result.c_weight is None
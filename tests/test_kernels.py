@@ -0,0 +1,80 @@
+"""
+Test module for the compiled kernels
+"""
+from biosim import _kernels, Animal
+import numpy as np
+import pytest
+
+
+def test_hunt_step_stops_at_F():
+    """Test a carnivore that kills with certainty stops eating when it has eaten F"""
+    c_weight = np.array([50.0])
+    h_weight = np.array([20.0, 20.0, 20.0, 20.0])
+    eaten = _kernels.hunt_step(np.array([1.0]), c_weight, np.zeros(4), h_weight,
+                               50.0, 0.75, 0.5, np.zeros((1, 4)))
+
+    assert list(eaten) == [True, True, True, False]
+    assert c_weight[0] == 50.0 + 0.75 * 60.0
+
+
+def test_hunt_step_no_kill_of_fitter_herbivores():
+    """Test carnivores never kill herbivores with higher fitness"""
+    c_weight = np.array([30.0, 20.0])
+    eaten = _kernels.hunt_step(np.array([0.2, 0.1]), c_weight, np.array([0.5, 0.6]),
+                               np.array([10.0, 10.0]), 50.0, 0.75, 10.0, np.zeros((2, 2)))
+
+    assert not eaten.any()
+    assert list(c_weight) == [30.0, 20.0]
+
+
+def test_age_and_die():
+    """Test animals lose weight, animals without weight die and omega = 0 keeps the others"""
+    ages, weights, fitness = np.array([1.0, 1.0, 5.0]), np.array([10.0, 0.0, 20.0]), np.empty(3)
+    dies = _kernels.age_and_die(ages, weights, fitness, 0.5, 0.0,
+                                Animal.Herbivores._param_vec, np.full(3, 0.5))
+
+    assert list(dies) == [False, True, False]
+    assert list(ages) == [2.0, 2.0, 6.0]
+    assert list(weights) == [5.0, 0.0, 10.0]
+
+
+@pytest.mark.parametrize('species', [Animal.Herbivores, Animal.Carnivores])
+def test_grow_loss(species):
+    """Test the animals age and lose weight, and the fitness is the fitness after the year"""
+    ages, weights = np.array([0.0, 3.0, 10.0, 4.0]), np.array([5.0, 20.0, 40.0, 0.0])
+    fitness = _kernels.grow_loss(ages, weights, np.empty(4), species.parameter['eta'],
+                                 species._param_vec)
+
+    assert list(ages) == [1.0, 4.0, 11.0, 5.0]
+    assert weights[-1] == 0.0
+    assert list(fitness) == [species(age, weight).fitness for age, weight in zip(ages, weights)]
+
+
+@pytest.mark.parametrize('species', [Animal.Herbivores, Animal.Carnivores])
+def test_update_fitness(species):
+    """Test the kernel fitness is the fitness of the animals, 0 without weight"""
+    ages = np.array([0.0, 3.0, 10.0, 4.0])
+    weights = np.array([5.0, 20.0, 40.0, 0.0])
+    fitness = _kernels.update_fitness(ages, weights, np.empty(4), species._param_vec)
+
+    assert list(fitness) == [species(age, weight).fitness for age, weight in zip(ages, weights)]
+
+
+@pytest.mark.parametrize('age, weight', [(1e4, 1e4), (2000.0, 1e5), (5000.0, 50.0)])
+def test_fitness_overflow(age, weight):
+    """Test the fitness is 0 and not an error when np.exp overflows for very old animals"""
+    assert _kernels.fitness(age, weight, Animal.Herbivores._param_vec) == 0.0
+    assert Animal.Herbivores(age, weight).fitness == 0.0
+
+
+def test_fitness_kernels_overflow():
+    """Test the array kernels give fitness 0 and not an error when np.exp overflows"""
+    param_vec = Animal.Herbivores._param_vec
+    ages, weights = np.array([1e4, 5.0]), np.array([1e4, 20.0])
+    fitness = _kernels.update_fitness(ages, weights, np.empty(2), param_vec)
+    assert fitness[0] == 0.0
+    fitness = _kernels.grow_loss(ages.copy(), weights.copy(), np.empty(2), 0.05, param_vec)
+    assert fitness[0] == 0.0
+    dies = _kernels.age_and_die(ages.copy(), weights.copy(), np.empty(2), 0.05, 0.4, param_vec,
+                                np.full(2, 0.1))
+    assert dies[0]
@@ -3,22 +3,41 @@ Test module for simulation
 """
 from biosim.simulation import BioSim
 from biosim import Animal, Cell
+import copy
 import pytest
 
+# built once at import and shared by both test classes, BioSim only reads the population
+ISLAND_MAP = "WWW\nWLW\nWWW"
+HERB_TEMPLATE = {"species": "Herbivore", "age": 5, "weight": 20}
+INI_POP_5 = ({"loc": (2, 2), "pop": [HERB_TEMPLATE] * 5},)
+INI_POP_50 = ({"loc": (2, 2), "pop": [HERB_TEMPLATE] * 50},)
+SEED = 1
+
+
+@pytest.fixture(autouse=True)
+def restore_parameters():
+    """Restore the animal and landscape parameters the tests change, which are class level and
+    would otherwise leak into the following tests"""
+    herbivore_params = copy.deepcopy(Animal.Herbivores.parameter)
+    carnivore_params = copy.deepcopy(Animal.Carnivores.parameter)
+    cell_params = copy.deepcopy(Cell.Cell.ParamCell)
+    yield
+    Animal.Herbivores.set_params(herbivore_params)
+    Animal.Carnivores.set_params(carnivore_params)
+    Cell.Cell.ParamCell.update(cell_params)
+
+
+@pytest.fixture(scope="module")
+def plain_sim():
+    """Create one plain_sim instance of BioSim shared by the parameter tests, which only change
+    the parameters restored by restore_parameters."""
+    return BioSim(ISLAND_MAP, INI_POP_5, SEED)
+
 
 class TestSimParams:
     """
     Test for Simulation Parameters
     """
-    @pytest.fixture(autouse=True)
-    def create_sim(self):
-        """Create a plain_sim instance of BioSim for testing."""
-        self.island_map = ("WWW\nWLW\nWWW")
-        self.ini_pop = [{"loc": (2, 2), "pop": [{"species": "Herbivore", "age": 5, "weight": 20}
-                                                for _ in range(5)]}]
-        self.seed = 1
-        self.plain_sim = BioSim(self.island_map, self.ini_pop, self.seed)
-
     @pytest.mark.parametrize('species, param_dict',
                              [('tiger', {'beta': 0, 'eta': 0}),
                               (0, {'mu': 0, 'gama': 0}),
@@ -27,10 +46,10 @@ class TestSimParams:
                               ('Herbivore', {'beta': -1}),
                               ('Herbivore', {'X': 100}),
                               ('Carnivore', {'Y': 100})])
-    def test_set_animal_parameters_illegal(self, species, param_dict):
+    def test_set_animal_parameters_illegal(self, plain_sim, species, param_dict):
         """Test the illegal input for set_animal_parameters"""
         with pytest.raises((TypeError, AttributeError, ValueError)):
-            self.plain_sim.set_animal_parameters(species, param_dict)
+            plain_sim.set_animal_parameters(species, param_dict)
 
     @pytest.mark.parametrize('species, param_dict',
                              [('Herbivore', {'beta': 0, 'eta': 0}),
@@ -38,12 +57,11 @@ class TestSimParams:
                               ('Herbivore', {'mu': 0, 'gamma': 0}),
                               ('Herbivore', {'F': 20, 'w_half': 10})
                               ])
-    def test_set_herbivore_parameters_legal(self, species, param_dict):
+    def test_set_herbivore_parameters_legal(self, plain_sim, species, param_dict):
         """Test legal input of herbivores for set_animal_parameters"""
-        self.plain_sim.set_animal_parameters(species, param_dict)
+        plain_sim.set_animal_parameters(species, param_dict)
         herb_parameters = Animal.Herbivores.parameter
-        herb_true = all([herb_parameters[key] == param_dict[key] for key in param_dict])
-        assert herb_true
+        assert all(herb_parameters[key] == value for key, value in param_dict.items())
 
     @pytest.mark.parametrize('species, param_dict',
                              [('Carnivore', {'beta': 10, 'eta': 20}),
@@ -51,12 +69,11 @@ class TestSimParams:
                               ('Carnivore', {'mu': 0, 'gamma': 0}),
                               ('Carnivore', {'F': 20, 'DeltaPhiMax': 10})
                               ])
-    def test_set_carnivore_parameters_legal(self, species, param_dict):
+    def test_set_carnivore_parameters_legal(self, plain_sim, species, param_dict):
         """Test legal input of carnivores for set_animal_parameters"""
-        self.plain_sim.set_animal_parameters(species, param_dict)
+        plain_sim.set_animal_parameters(species, param_dict)
         carn_parameters = Animal.Carnivores.parameter
-        carn_true = all([carn_parameters[key] == param_dict[key] for key in param_dict])
-        assert carn_true
+        assert all(carn_parameters[key] == value for key, value in param_dict.items())
 
     @pytest.mark.parametrize('landscape, params',
                              [('X', {'f_max': 700}),
@@ -65,18 +82,18 @@ class TestSimParams:
                               ('H', {'f_max': -1}),
                               ('L', {'F_max': 100}),
                               ])
-    def test_set_landscape_parameters_illegal(self, landscape, params):
+    def test_set_landscape_parameters_illegal(self, plain_sim, landscape, params):
         """Test illegal input for set_landscape_parameters"""
         with pytest.raises((TypeError, KeyError, AttributeError, ValueError)):
-            self.plain_sim.set_landscape_parameters(landscape, params)
+            plain_sim.set_landscape_parameters(landscape, params)
 
     @pytest.mark.parametrize('landscape, params',
                              [('H', {'f_max': 100}),
                               ('H', {'f_max': 200}),
                               ])
-    def test_set_H_landscape_parameters_legal(self, landscape, params):
+    def test_set_H_landscape_parameters_legal(self, plain_sim, landscape, params):
         """Test legal input of high land for set_landscape_parameters"""
-        self.plain_sim.set_landscape_parameters(landscape, params)
+        plain_sim.set_landscape_parameters(landscape, params)
         H_parameters = Cell.Cell.ParamCell['f_max_H']
         assert H_parameters == params['f_max']
 
@@ -84,42 +101,32 @@ class TestSimParams:
                              [('L', {'f_max': 300}),
                               ('L', {'f_max': 400}),
                               ])
-    def test_set_L_landscape_parameters_legal(self, landscape, params):
+    def test_set_L_landscape_parameters_legal(self, plain_sim, landscape, params):
         """Test legal input of low land for set_landscape_parameters"""
-        self.plain_sim.set_landscape_parameters(landscape, params)
+        plain_sim.set_landscape_parameters(landscape, params)
         L_parameters = Cell.Cell.ParamCell['f_max_L']
         assert L_parameters == params['f_max']
 
+    def test_steep_fitness_parameters(self):
+        """Test legal but steep fitness parameters, which overflow np.exp for old and heavy
+        animals, give them fitness 0 instead of an error"""
+        sim = BioSim(ISLAND_MAP, [{'loc': (2, 2), 'pop': [{'species': 'Herbivore', 'age': 120,
+                                                          'weight': 90}] * 5}], SEED, vis_years=0)
+        sim.set_animal_parameters('Herbivore', {'phi_age': 10, 'phi_weight': 10})
 
-class TestSimRes:
+        assert Animal.Herbivores(120, 90).fitness == 0.0
+        sim.simulate(1)
+        assert sim.year == 1
+
+
+class TestSimPopulation:
     """
-    Test for Simulation Results
+    Test for adding populations, which do not need a simulated year
     """
-    @pytest.fixture(autouse=True)
-    def create_sim(self):
-        """Create a sim instance of BioSim for testing."""
-        self.island_map = ("WWW\nWLW\nWWW")
-        ini_herbs = [{'loc': (2, 2),
-                      'pop': [{'species': 'Herbivore',
-                               'age': 5,
-                               'weight': 20}
-                              for _ in range(50)]}]
-        self.ini_pop = ini_herbs
-        self.seed = 100
-        self.sim = BioSim(self.island_map, self.ini_pop, self.seed)
-
-    @pytest.fixture(autouse=True)
-    def test_simulation(self):
-        """Simulate 1 year for other testing."""
-        self.sim.simulate(1)
-
-    def test_year(self, test_simulation):
-        """Test the year method"""
-        assert self.sim.year == 1
-
-    def test_num_animals(self, test_simulation):
-        """Test the num_animals method"""
-        assert self.sim.num_animals <= len(self.ini_pop[0]['pop'])
+    @pytest.fixture()
+    def sim(self):
+        """Create a sim instance of BioSim for the tests which change it."""
+        return BioSim(ISLAND_MAP, INI_POP_50, 100)
 
     @pytest.mark.parametrize('population',
                              [[{'loc': (2, 2), 'pop': [{'species': 'Carnivore',
@@ -131,18 +138,80 @@ class TestSimRes:
                                          'weight': 10}
                                         for _ in range(30)]}]
                               ])
-    def test_add_population(self, population, test_simulation):
+    def test_add_population(self, population, sim):
         """Test the add_population method"""
-        num = self.sim.num_animals
-        self.sim.add_population(population)
-        assert self.sim.num_animals >= num
+        num = sim.num_animals
+        sim.add_population(population)
+        assert sim.num_animals >= num
 
-    def test_num_animals_per_species(self, test_simulation):
+
+@pytest.mark.slow
+class TestSimRes:
+    """
+    Test for Simulation Results
+    """
+    seed = 100
+
+    @pytest.fixture(scope="class")
+    @classmethod
+    def simulated_sim(cls):
+        """Create a sim instance of BioSim and simulate 1 year, once for all tests of the class
+        which only read the result."""
+        sim = BioSim(ISLAND_MAP, INI_POP_50, cls.seed)
+        sim.simulate(1)
+        return sim
+
+    def test_year(self, simulated_sim):
+        """Test the year method"""
+        assert simulated_sim.year == 1
+
+    def test_num_animals(self, simulated_sim):
+        """Test the num_animals method"""
+        assert simulated_sim.num_animals <= len(INI_POP_50[0]['pop'])
+
+    def test_num_animals_per_species(self, simulated_sim):
         """Test the num_animals_per_species method"""
-        num_dict = self.sim.num_animals_per_species
-        num_dict['Herbivore'] == self.sim._herbivores_num
-        num_dict['Carnivore'] == self.sim._carnivores_num
+        num_dict = simulated_sim.num_animals_per_species
+
+        assert simulated_sim.num_animals == num_dict['Herbivore'] + num_dict['Carnivore'] \
+            and num_dict['Herbivore'] == simulated_sim._herbivores_num \
+            and num_dict['Carnivore'] == simulated_sim._carnivores_num
 
-        assert (self.sim.num_animals == (num_dict['Herbivore'] + num_dict['Carnivore'])) \
-            & (num_dict['Herbivore'] == self.sim._herbivores_num) \
-            & (num_dict['Carnivore'] == self.sim._carnivores_num)
+
+class TestSimCycle:
+    """
+    Test for the simulated years, quick enough to run by default
+    """
+    seed = 100
+
+    def test_visualized_and_saved_years(self, monkeypatch):
+        """Test the visualized and saved years stay multiples of vis_years and img_years over
+        several calls to simulate"""
+        sim = BioSim(ISLAND_MAP, INI_POP_50, self.seed, vis_years=2, img_years=4)
+        visualized, saved = [], []
+        monkeypatch.setattr(sim.graphics, 'visualize', lambda year, *args: visualized.append(year))
+        monkeypatch.setattr(sim.graphics, 'save_graphics', lambda: saved.append(sim.year))
+        sim.simulate(5)
+        sim.simulate(4)
+
+        assert visualized == [0, 2, 4, 6, 8]
+        assert saved == [0, 4, 8]
+
+    def test_headless(self):
+        """Test vis_years = 0 runs the years without creating the graphics"""
+        sim = BioSim(ISLAND_MAP, INI_POP_50, self.seed, vis_years=0)
+        sim.simulate(3)
+
+        assert sim.year == 3
+        assert sim._graphics is None
+        assert sim.num_animals == sum(sim._map_instance.population_stats()[:2])
+
+    def test_threads(self):
+        """Test that feeding the cells in threads gives the same counts as feeding them in turn"""
+        sims = [BioSim(ISLAND_MAP, INI_POP_50, self.seed, vis_years=0, n_threads=n_threads)
+                for n_threads in (1, 2)]
+        for sim in sims:
+            sim.simulate(3)
+        sims[1]._map_instance.close()
+
+        assert sims[0].num_animals_per_species == sims[1].num_animals_per_species